@@ -3,23 +3,95 @@
 
 import json
 import base64
+import collections
+import math
+import mmap
 import time
 import re
 import threading
+import queue
 import concurrent.futures
+from multiprocessing import shared_memory
 from io import BytesIO
-from PIL import Image
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageSequence, ImageStat
 import urllib.request
 import urllib.parse
 import urllib.error
+import http.client
+import socket
+import ssl
 import os
 import importlib.util
 import sys
 import types
 
+# 结构化输出的JSON Schema
+COORDINATES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "texts": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "text": {"type": "string"},
+                    "box": {
+                        "type": "array",
+                        "items": {"type": "array", "items": {"type": "number"}},
+                    },
+                },
+                "required": ["text", "box"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["texts"],
+    "additionalProperties": False,
+}
+
+CORRECTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "lines": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["lines"],
+    "additionalProperties": False,
+}
+
+DIFF_CORRECTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "changes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "index": {"type": "integer"},
+                    "text": {"type": "string"},
+                },
+                "required": ["index", "text"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["changes"],
+    "additionalProperties": False,
+}
+
+# 各输出格式的生成token上限（仅对支持按请求设置的服务商生效，如 Ollama 的 num_predict）
+OUTPUT_TOKEN_BUDGET = {
+    "text_only": 4096,
+    "with_coordinates": 6144,
+}
+
 # Provider基类
 class BaseProvider:
     """AI OCR服务提供商基类"""
+
+    # 是否支持约束输出格式（JSON Schema / JSON模式）
+    supports_response_schema = False
+    # 可接受的上传图像格式（PIL格式名）
+    supported_image_formats = ("JPEG", "PNG")
     
     def __init__(self, api_key, api_base=None, model=None, timeout=30, proxy_url=None):
         self.api_key = api_key
@@ -48,9 +120,55 @@ class BaseProvider:
         """解析响应"""
         raise NotImplementedError
 
+    def apply_response_schema(self, payload, name, schema):
+        """在请求载荷中加入结构化输出约束（仅 supports_response_schema 为 True 时调用）"""
+        return payload
+
+    def apply_output_limit(self, payload, max_tokens):
+        """按任务设置生成token上限；默认沿用 build_payload 中的固定值（推理模型需要余量思考）"""
+        return payload
+
+    def cap_output_tokens(self, payload, max_tokens):
+        """强制限制输出token数，仅用于连接测试的最小推理"""
+        if "max_tokens" in payload:
+            payload["max_tokens"] = min(payload["max_tokens"], int(max_tokens))
+        return payload
+
+    def get_models_url(self):
+        """轻量健康检查用的模型列表地址（OpenAI兼容接口）；返回 None 表示不支持"""
+        return f"{self.api_base or self.get_default_api_base()}/models"
+
+    def find_model(self, response_text):
+        """在模型列表响应中查找当前模型，返回 True/False；无法判断时返回 None"""
+        try:
+            ids = {m.get("id") for m in json.loads(response_text).get("data", []) if isinstance(m, dict)}
+        except Exception:
+            return None
+        return (self.model in ids) if ids else None
+
+    def get_image_mime(self, image_base64):
+        """根据base64数据头识别图像MIME类型，无法识别时按JPEG处理"""
+        if image_base64.startswith("iVBOR"):
+            return "image/png"
+        if image_base64.startswith("UklGR"):
+            return "image/webp"
+        if image_base64.startswith("R0lGOD"):
+            return "image/gif"
+        return "image/jpeg"
+
+    def estimate_image_tokens(self, width, height):
+        """估算图像输入token数，用于按计费方式选择缩放尺寸；返回 None 表示计费方式未知"""
+        if "qwen" in (self.model or "").lower():
+            # Qwen-VL：每 28×28 像素块计1个token
+            return math.ceil(width / 28) * math.ceil(height / 28)
+        return None
+
 # OpenAI Provider
 class OpenAIProvider(BaseProvider):
     """OpenAI服务提供商"""
+
+    supports_response_schema = True
+    supported_image_formats = ("JPEG", "PNG", "WEBP")
     
     def get_default_api_base(self):
         return "https://api.openai.com/v1"
@@ -75,7 +193,7 @@ class OpenAIProvider(BaseProvider):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{self.get_image_mime(image_base64)};base64,{image_base64}"
                             }
                         }
                     ]
@@ -95,8 +213,26 @@ class OpenAIProvider(BaseProvider):
         except Exception as e:
             raise Exception(f"解析OpenAI响应失败: {str(e)}")
 
+    def apply_response_schema(self, payload, name, schema):
+        payload["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": name, "schema": schema, "strict": True},
+        }
+        return payload
+
+    def estimate_image_tokens(self, width, height):
+        # high detail：先缩放到 2048×2048 以内，再将短边缩到 768，按 512px 瓦片计费
+        scale = min(1.0, 2048 / max(width, height))
+        width, height = width * scale, height * scale
+        scale = min(1.0, 768 / min(width, height))
+        width, height = width * scale, height * scale
+        return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
 # Google Gemini Provider
 class GeminiProvider(BaseProvider):
+    supports_response_schema = True
+    supported_image_formats = ("JPEG", "PNG", "WEBP")
+
     def get_default_api_base(self):
         return "https://generativelanguage.googleapis.com/v1beta"
         
@@ -115,7 +251,7 @@ class GeminiProvider(BaseProvider):
                     {"text": prompt},
                     {
                         "inline_data": {
-                            "mime_type": "image/jpeg",
+                            "mime_type": self.get_image_mime(image_base64),
                             "data": image_base64
                         }
                     }
@@ -134,6 +270,47 @@ class GeminiProvider(BaseProvider):
         except Exception as e:
             raise Exception(f"解析Gemini响应失败: {str(e)}")
 
+    def apply_response_schema(self, payload, name, schema):
+        # 复制 generationConfig，避免改动调用方保留的普通载荷
+        payload["generationConfig"] = dict(payload.get("generationConfig", {}), **{
+            "responseMimeType": "application/json",
+            "responseSchema": self._to_gemini_schema(schema),
+        })
+        return payload
+
+    def cap_output_tokens(self, payload, max_tokens):
+        payload["generationConfig"] = dict(payload.get("generationConfig", {}), maxOutputTokens=int(max_tokens))
+        return payload
+
+    def get_models_url(self):
+        return f"{self.api_base or self.get_default_api_base()}/models/{self.model}?key={self.api_key}"
+
+    def find_model(self, response_text):
+        # 直接查询单个模型，请求成功即模型存在
+        return True
+
+    def _to_gemini_schema(self, schema):
+        """转换为Gemini的OpenAPI子集：类型名大写，去掉不支持的 additionalProperties"""
+        if isinstance(schema, dict):
+            converted = {}
+            for key, value in schema.items():
+                if key == "additionalProperties":
+                    continue
+                if key == "type" and isinstance(value, str):
+                    converted[key] = value.upper()
+                else:
+                    converted[key] = self._to_gemini_schema(value)
+            return converted
+        if isinstance(schema, list):
+            return [self._to_gemini_schema(v) for v in schema]
+        return schema
+
+    def estimate_image_tokens(self, width, height):
+        # 两边均不超过 384px 计 258 token，否则按 768px 瓦片每块 258 token
+        if width <= 384 and height <= 384:
+            return 258
+        return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+
 # 硅基流动 Provider
 class SiliconFlowProvider(BaseProvider):
     """硅基流动服务提供商"""
@@ -161,7 +338,7 @@ class SiliconFlowProvider(BaseProvider):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{self.get_image_mime(image_base64)};base64,{image_base64}"
                             }
                         }
                     ]
@@ -188,6 +365,8 @@ class SiliconFlowProvider(BaseProvider):
 # 阿里云百炼 Provider
 class AlibabaProvider(BaseProvider):
     """阿里云百炼服务提供商"""
+
+    supported_image_formats = ("JPEG", "PNG", "WEBP")
     
     def get_default_api_base(self):
         return "https://dashscope.aliyuncs.com/api/v1"
@@ -211,7 +390,7 @@ class AlibabaProvider(BaseProvider):
                         "content": [
                             {"text": prompt},
                             {
-                                "image": f"data:image/jpeg;base64,{image_base64}"
+                                "image": f"data:{self.get_image_mime(image_base64)};base64,{image_base64}"
                             }
                         ]
                     }
@@ -300,7 +479,7 @@ class DoubaoProvider(BaseProvider):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{self.get_image_mime(image_base64)};base64,{image_base64}"
                             }
                         }
                     ]
@@ -351,7 +530,7 @@ class OpenRouterProvider(BaseProvider):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{self.get_image_mime(image_base64)};base64,{image_base64}"
                             }
                         }
                     ]
@@ -395,7 +574,7 @@ class XAIProvider(BaseProvider):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{self.get_image_mime(image_base64)};base64,{image_base64}"
                             }
                         }
                     ]
@@ -441,7 +620,7 @@ class ZhipuProvider(BaseProvider):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{self.get_image_mime(image_base64)};base64,{image_base64}"
                             }
                         }
                     ]
@@ -491,7 +670,7 @@ class ModelScopeProvider(BaseProvider):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{self.get_image_mime(image_base64)};base64,{image_base64}"
                             }
                         }
                     ]
@@ -517,6 +696,11 @@ class ModelScopeProvider(BaseProvider):
 # Ollama Provider (本地)
 class OllamaProvider(BaseProvider):
     """Ollama本地服务提供商"""
+
+    supports_response_schema = True
+    # 模型保持时间（如 "30m"、"-1"）与上下文长度，由 Api.start 按配置设置；num_ctx 变化会使 Ollama 重新加载模型
+    keep_alive = None
+    num_ctx = 0
     
     def get_default_api_base(self):
         return "http://localhost:11434/api"
@@ -530,12 +714,47 @@ class OllamaProvider(BaseProvider):
         }
         
     def build_payload(self, image_base64, prompt):
-        return {
+        payload = {
             "model": self.model or self.get_default_model(),
             "prompt": prompt,
             "images": [image_base64],
             "stream": False
         }
+        return self._apply_model_options(payload)
+
+    def build_load_payload(self, keep_alive=None):
+        """不带提示词的 /api/generate 载荷：仅加载模型并设置保持时间"""
+        payload = {"model": self.model or self.get_default_model()}
+        return self._apply_model_options(payload, keep_alive)
+
+    def _apply_model_options(self, payload, keep_alive=None):
+        keep_alive = keep_alive or self.keep_alive
+        if keep_alive:
+            # 纯数字按秒处理（Ollama 要求数值类型），其余如 "30m" 原样传递
+            payload["keep_alive"] = int(keep_alive) if re.fullmatch(r"-?\d+", str(keep_alive)) else keep_alive
+        if self.num_ctx:
+            payload.setdefault("options", {})["num_ctx"] = int(self.num_ctx)
+        return payload
+
+    def apply_output_limit(self, payload, max_tokens):
+        payload.setdefault("options", {})["num_predict"] = int(max_tokens)
+        return payload
+
+    def cap_output_tokens(self, payload, max_tokens):
+        return self.apply_output_limit(payload, max_tokens)
+
+    def get_models_url(self):
+        return f"{self.api_base or self.get_default_api_base()}/tags"
+
+    def find_model(self, response_text):
+        try:
+            names = set()
+            for m in json.loads(response_text).get("models", []):
+                names.update((m.get("name"), m.get("model")))
+        except Exception:
+            return None
+        # 未写标签的模型名在 Ollama 中等同于 :latest
+        return self.model in names or f"{self.model}:latest" in names
         
     def parse_response(self, response_text):
         try:
@@ -548,6 +767,10 @@ class OllamaProvider(BaseProvider):
         except Exception as e:
             raise Exception(f"解析Ollama响应失败: {str(e)}")
 
+    def apply_response_schema(self, payload, name, schema):
+        payload["format"] = schema
+        return payload
+
 # LM Studio Provider (本地)
 class LMStudioProvider(BaseProvider):
     """LM Studio本地服务提供商"""
@@ -575,7 +798,7 @@ class LMStudioProvider(BaseProvider):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{self.get_image_mime(image_base64)};base64,{image_base64}"
                             }
                         }
                     ]
@@ -600,6 +823,8 @@ class LMStudioProvider(BaseProvider):
 class GroqProvider(BaseProvider):
     """Groq服务提供商"""
 
+    supports_response_schema = True
+
     def get_default_api_base(self):
         return "https://api.groq.com/openai/v1"
 
@@ -630,7 +855,7 @@ class GroqProvider(BaseProvider):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{self.get_image_mime(image_base64)};base64,{image_base64}"
                             }
                         }
                     ]
@@ -663,6 +888,11 @@ class GroqProvider(BaseProvider):
         except Exception as e:
             raise Exception(f"解析Groq响应失败: {str(e)}")
 
+    def apply_response_schema(self, payload, name, schema):
+        # Groq 视觉模型仅支持JSON模式，结构由提示词约定
+        payload["response_format"] = {"type": "json_object"}
+        return payload
+
 
 # 无问芯穷 Provider
 class InfinigenceProvider(BaseProvider):
@@ -692,7 +922,7 @@ class InfinigenceProvider(BaseProvider):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{self.get_image_mime(image_base64)};base64,{image_base64}"
                             }
                         }
                     ]
@@ -720,6 +950,9 @@ class InfinigenceProvider(BaseProvider):
 class MistralProvider(BaseProvider):
     """Mistral AI服务提供商 (使用视觉模型)"""
 
+    supports_response_schema = True
+    supported_image_formats = ("JPEG", "PNG", "WEBP")
+
     def get_default_api_base(self):
         return "https://api.mistral.ai/v1"
 
@@ -744,7 +977,7 @@ class MistralProvider(BaseProvider):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{self.get_image_mime(image_base64)};base64,{image_base64}"
                             }
                         }
                     ]
@@ -783,6 +1016,11 @@ class MistralProvider(BaseProvider):
         except Exception as e:
             raise Exception(f"解析Mistral响应失败: {str(e)}")
 
+    def apply_response_schema(self, payload, name, schema):
+        # 使用JSON模式，结构由提示词约定
+        payload["response_format"] = {"type": "json_object"}
+        return payload
+
 
 # 书生AI Provider
 """书生AI服务提供商"""
@@ -812,7 +1050,7 @@ class InternProvider(BaseProvider):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{self.get_image_mime(image_base64)};base64,{image_base64}"
                             }
                         }
                     ]
@@ -896,9 +1134,19 @@ class ProviderFactory:
 
 # HTTP请求工具类
 class HTTPClient:
+    # 空闲连接超过该秒数不再复用（多数服务端的 keep-alive 超时在60秒以上）
+    IDLE_TIMEOUT = 50
+
     def __init__(self, timeout=30, proxy_url=None):
         self.timeout = timeout
         self.proxy_url = proxy_url
+        # 不走代理时复用 keep-alive 连接：(scheme, host, port) -> [(连接, 放回时间)]
+        self._idle = {}
+        self._idle_lock = threading.Lock()
+        # 进行中的请求所用连接，shutdown() 超时后关闭其 socket 以中断阻塞的读写
+        self._active = set()
+        self._active_cond = threading.Condition()
+        self._closed = False
     
     def post_multipart(self, url, headers=None, files=None, data=None):
         """发送 multipart/form-data POST请求（用于文件上传）"""
@@ -1021,8 +1269,170 @@ class HTTPClient:
         except Exception as e:
             raise Exception(f"Multipart HTTP请求失败: {str(e)}")
     
+    def _ssl_context(self):
+        ssl_context = ssl.create_default_context()
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+        return ssl_context
+
+    def _connection_key(self, url):
+        parts = urllib.parse.urlsplit(url)
+        return parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)
+
+    def _acquire(self, key):
+        """取一条未过期的空闲连接，没有时新建；返回 (连接, 是否复用)"""
+        now = time.time()
+        with self._idle_lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, since = idle.pop()
+                if now - since < self.IDLE_TIMEOUT:
+                    return conn, True
+                conn.close()
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self._ssl_context()), False
+        return http.client.HTTPConnection(host, port, timeout=self.timeout), False
+
+    def _release(self, key, conn):
+        with self._idle_lock:
+            self._idle.setdefault(key, []).append((conn, time.time()))
+
+    def _is_direct(self, url):
+        """是否直连（可用 keep-alive 连接池）：未配置代理，且系统代理（环境变量/注册表）不适用于该地址"""
+        if self.proxy_url:
+            return False
+        parts = urllib.parse.urlsplit(url)
+        if not urllib.request.getproxies().get(parts.scheme):
+            return True
+        return bool(urllib.request.proxy_bypass(parts.hostname or ''))
+
+    def preconnect(self, url):
+        """预先完成 DNS 解析、TCP 与 TLS 握手并放入空闲连接池，首个请求直接复用；走代理时不适用，返回 False"""
+        if not self._is_direct(url):
+            return False
+        key = self._connection_key(url)
+        conn, reused = self._acquire(key)
+        if not reused:
+            conn.connect()
+        self._release(key, conn)
+        return True
+
+    def close(self):
+        """关闭全部空闲连接"""
+        with self._idle_lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+    def shutdown(self, grace=0, keep_idle=False):
+        """停止客户端：拒绝新请求，最多等待 grace 秒让进行中的请求完成，之后关闭其 socket 强制中断。
+        走代理（urllib）的请求无法中断，只能等其超时。keep_idle 为真时保留空闲连接，可由 reopen() 重新启用。
+        """
+        deadline = time.time() + max(0, grace)
+        with self._active_cond:
+            # 与 _request_keepalive 登记连接在同一把锁下置位：请求要么看到已停止，要么已在 _active 中
+            self._closed = True
+            while self._active and time.time() < deadline:
+                self._active_cond.wait(deadline - time.time())
+            active = list(self._active)
+        for conn in active:
+            # 禁止 http.client 在 socket 关闭后自动重连
+            conn.auto_open = 0
+            sock = conn.sock
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            conn.close()
+        if active:
+            print(f"[AIOCR] 已中断 {len(active)} 个进行中的请求")
+        if not keep_idle:
+            self.close()
+
+    def reopen(self):
+        """重新启用 shutdown(keep_idle=True) 停止的客户端，保留的空闲连接继续复用"""
+        with self._active_cond:
+            self._closed = False
+
+    def _request_keepalive(self, method, url, headers, body):
+        """在复用的 keep-alive 连接上发送请求，返回 (状态码, 响应头, 响应体)"""
+        key = self._connection_key(url)
+        parts = urllib.parse.urlsplit(url)
+        path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        for attempt in range(2):
+            conn, reused = self._acquire(key)
+            with self._active_cond:
+                if self._closed:
+                    conn.close()
+                    raise Exception("客户端已停止")
+                self._active.add(conn)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                # 建立连接期间 shutdown() 可能已中断过本连接（当时尚无 socket 可关闭）
+                if self._closed and conn.auto_open == 0:
+                    raise Exception("客户端已停止")
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # 复用的空闲连接已被服务端关闭，换新连接重试一次
+                if reused and attempt == 0 and not self._closed:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            finally:
+                with self._active_cond:
+                    self._active.discard(conn)
+                    self._active_cond.notify_all()
+            if self._closed:
+                conn.close()
+                return response.status, response.headers, data
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            return response.status, response.headers, data
+
+    def _decode_body(self, data, headers):
+        """按 Content-Encoding 解压并解码为文本"""
+        content_encoding = headers.get('Content-Encoding', '').lower() if headers is not None else ''
+        try:
+            if content_encoding == 'gzip':
+                import gzip
+                data = gzip.decompress(data)
+            elif content_encoding == 'deflate':
+                import zlib
+                data = zlib.decompress(data)
+            elif content_encoding == 'br':
+                # 尝试Brotli解压，未安装brotli库时忽略
+                import brotli
+                data = brotli.decompress(data)
+        except Exception:
+            pass
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError:
+            try:
+                return data.decode('latin-1')
+            except UnicodeDecodeError:
+                return data.decode('utf-8', errors='ignore')
+
     def post(self, url, headers=None, data=None):
-        """发送POST请求"""
+        """发送POST请求（不走代理时复用 keep-alive 连接）"""
+        return self._request('POST', url, headers, data)
+
+    def get(self, url, headers=None):
+        """发送GET请求（用于模型列表、状态查询等轻量接口）"""
+        return self._request('GET', url, headers)
+
+    def _request(self, method, url, headers=None, data=None):
+        if self._closed:
+            raise Exception("HTTP请求失败: 客户端已停止")
         try:
             # 设置默认请求头
             try:
@@ -1045,116 +1455,712 @@ class HTTPClient:
             
             # 准备请求数据
             req_data = data.encode('utf-8') if isinstance(data, str) else data
-            req = urllib.request.Request(url, data=req_data, headers=default_headers)
             
-            # 创建 SSL 上下文
-            import ssl
-            ssl_context = ssl.create_default_context()
-            ssl_context.check_hostname = False
-            ssl_context.verify_mode = ssl.CERT_NONE
+            if self._is_direct(url):
+                status, response_headers, response_data = self._request_keepalive(method, url, default_headers, req_data)
+                return {
+                    'status_code': status,
+                    'text': self._decode_body(response_data, response_headers)
+                }
             
-            # 设置代理和 SSL
+            # 走代理时使用 urllib（未配置代理时默认 ProxyHandler 沿用系统代理）
+            req = urllib.request.Request(url, data=req_data, headers=default_headers, method=method)
+            https_handler = urllib.request.HTTPSHandler(context=self._ssl_context())
             if self.proxy_url:
                 proxy_handler = urllib.request.ProxyHandler({
                     'http': self.proxy_url, 
                     'https': self.proxy_url
                 })
-                https_handler = urllib.request.HTTPSHandler(context=ssl_context)
                 opener = urllib.request.build_opener(proxy_handler, https_handler)
             else:
-                https_handler = urllib.request.HTTPSHandler(context=ssl_context)
                 opener = urllib.request.build_opener(https_handler)
             
             # 发送请求
             response = opener.open(req, timeout=self.timeout)
-            response_data = response.read()
-            
-            # 处理压缩响应
-            content_encoding = response.headers.get('Content-Encoding', '').lower()
-            if content_encoding == 'gzip':
-                import gzip
-                response_data = gzip.decompress(response_data)
-            elif content_encoding == 'deflate':
-                import zlib
-                response_data = zlib.decompress(response_data)
-            elif content_encoding == 'br':
-                # 尝试Brotli解压，未安装brotli库时忽略
-                try:
-                    import brotli
-                    response_data = brotli.decompress(response_data)
-                except Exception:
-                    pass
-            
-            # 处理编码
-            try:
-                response_text = response_data.decode('utf-8')
-            except UnicodeDecodeError:
-                try:
-                    response_text = response_data.decode('latin-1')
-                except UnicodeDecodeError:
-                    response_text = response_data.decode('utf-8', errors='ignore')
-            
             return {
                 'status_code': response.getcode(),
-                'text': response_text
+                'text': self._decode_body(response.read(), response.headers)
             }
         except urllib.error.HTTPError as e:
-            error_data = e.read()
-            
-            # 处理错误响应的压缩
-            content_encoding = e.headers.get('Content-Encoding', '').lower() if hasattr(e, 'headers') else ''
-            if content_encoding == 'gzip':
-                import gzip
-                try:
-                    error_data = gzip.decompress(error_data)
-                except:
-                    pass
-            elif content_encoding == 'deflate':
-                import zlib
-                try:
-                    error_data = zlib.decompress(error_data)
-                except:
-                    pass
-            elif content_encoding == 'br':
-                try:
-                    import brotli
-                    error_data = brotli.decompress(error_data)
-                except Exception:
-                    pass
-            
-            try:
-                error_text = error_data.decode('utf-8')
-            except UnicodeDecodeError:
-                try:
-                    error_text = error_data.decode('latin-1')
-                except UnicodeDecodeError:
-                    error_text = error_data.decode('utf-8', errors='ignore')
-            
             return {
                 'status_code': e.code,
-                'text': error_text
+                'text': self._decode_body(e.read(), getattr(e, 'headers', None))
             }
         except Exception as e:
             raise Exception(f"HTTP请求失败: {str(e)}")
 
+# 紧凑坐标格式解析器
+class CompactCoordinateParser:
+    """紧凑坐标格式（每行 `x0,y0,x1,y1<TAB>文字`）的增量解析器。
+    可逐块 feed 流式输出，只解析已完整的行；finish() 再处理末尾可能被截断的残行。
+    """
+
+    LINE_RE = re.compile(
+        r"^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*(?:\t|\s+)(.*)$"
+    )
+
+    def __init__(self):
+        self._buffer = ""
+        self.items = []
+
+    def feed(self, chunk):
+        """追加一段输出，返回本次新解析出的条目"""
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split("\n")
+        new_items = [item for item in (self._parse_line(line) for line in lines) if item]
+        self.items.extend(new_items)
+        return new_items
+
+    def finish(self):
+        """处理剩余残行并返回全部条目"""
+        item = self._parse_line(self._buffer)
+        self._buffer = ""
+        if item:
+            self.items.append(item)
+        return self.items
+
+    @classmethod
+    def _parse_line(cls, line):
+        m = cls.LINE_RE.match(line.rstrip("\r"))
+        if not m:
+            return None
+        text = m.group(5).strip()
+        if not text:
+            return None
+        x0, y0, x1, y1 = (float(v) for v in m.group(1, 2, 3, 4))
+        return {"text": text, "rect": [min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)]}
+
+# JSON对象扫描器
+class JSONObjectScanner:
+    """单遍扫描定位文本中的JSON对象（感知括号与字符串转义），支持分块 feed。
+    找到首个可解析的完整对象后存入 result；输出被截断时 value() 从未闭合的 texts 数组中恢复已完整的条目。
+    """
+
+    _OUTSIDE_RE = re.compile(r"\{")
+    _STRUCT_RE = re.compile(r'["{}\[\]]')
+    _STRING_RE = re.compile(r'["\\]')
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        # 每层容器: [括号, 起始位置, 所属键名, 最近一个字符串, texts子项区间]
+        self._stack = []
+        self._in_string = False
+        self._str_start = 0
+        self._texts_spans = None
+        self.result = None
+
+    def feed(self, chunk):
+        """追加一段文本继续扫描，找到完整对象时返回该对象，否则返回 None"""
+        if self.result is not None:
+            return self.result
+        self._buf += chunk
+        buf = self._buf
+        n = len(buf)
+        pos = self._pos
+        while pos < n:
+            if self._in_string:
+                m = self._STRING_RE.search(buf, pos)
+                if not m:
+                    pos = n
+                    break
+                if m.group() == '\\':
+                    if m.end() >= n:
+                        # 转义符位于块尾，等待下一块
+                        pos = m.start()
+                        break
+                    pos = m.end() + 1
+                    continue
+                self._in_string = False
+                self._stack[-1][3] = buf[self._str_start + 1:m.start()]
+                pos = m.end()
+                continue
+            if not self._stack:
+                # 对象外的说明文字、代码块标记等直接跳过
+                m = self._OUTSIDE_RE.search(buf, pos)
+                if not m:
+                    pos = n
+                    break
+                self._stack.append(['{', m.start(), None, None, []])
+                pos = m.end()
+                continue
+            m = self._STRUCT_RE.search(buf, pos)
+            if not m:
+                pos = n
+                break
+            ch = m.group()
+            pos = m.end()
+            if ch == '"':
+                self._in_string = True
+                self._str_start = m.start()
+            elif ch in '{[':
+                parent = self._stack[-1]
+                key = parent[3] if parent[0] == '{' else None
+                self._stack.append([ch, m.start(), key, None, []])
+            else:
+                frame = self._stack.pop()
+                if frame[0] == '[' and frame[2] == 'texts':
+                    self._texts_spans = frame[4]
+                if self._stack:
+                    parent = self._stack[-1]
+                    if parent[0] == '[' and parent[2] == 'texts':
+                        parent[4].append((frame[1], pos))
+                    continue
+                try:
+                    self.result = json.loads(buf[frame[1]:pos])
+                    break
+                except Exception:
+                    # 并非有效JSON（如正文中的花括号），从该位置之后重新查找
+                    self._texts_spans = None
+                    pos = frame[1] + 1
+        self._pos = pos
+        return self.result
+
+    def value(self):
+        """返回完整对象；未闭合时返回恢复出的 {"texts": [...]}，无可用内容返回 None"""
+        if self.result is not None:
+            return self.result
+        spans = None
+        for frame in self._stack:
+            if frame[0] == '[' and frame[2] == 'texts':
+                spans = frame[4]
+                break
+        if spans is None:
+            spans = self._texts_spans
+        if not spans:
+            return None
+        items = []
+        for start, end in spans:
+            try:
+                items.append(json.loads(self._buf[start:end]))
+            except Exception:
+                continue
+        return {"texts": items} if items else None
+
+def classify_image(image):
+    """粗略判断图像内容，返回 (类别, 是否灰度)。
+    类别：screenshot（颜色少且有大面积纯色背景）、document（灰度文档/扫描件）、photo（其余）。
+    """
+    scale = min(1.0, 256 / max(image.size))
+    size = (max(1, int(image.size[0] * scale)), max(1, int(image.size[1] * scale)))
+    # 最近邻缩略图不混色，保留截图的原始颜色分布
+    thumb = image.resize(size, Image.Resampling.NEAREST)
+    if thumb.mode != 'RGB':
+        thumb = thumb.convert('RGB')
+    r, g, b = thumb.split()
+    chroma = ImageChops.lighter(ImageChops.difference(r, g), ImageChops.difference(g, b))
+    gray = ImageStat.Stat(chroma).mean[0] < 3
+    colors = thumb.getcolors(1024)
+    if colors and max(count for count, _ in colors) >= 0.3 * size[0] * size[1]:
+        return "screenshot", gray
+    return ("document" if gray else "photo"), gray
+
+def encode_image(image, quality, formats, encoding="auto"):
+    """按内容自适应编码，返回 (编码后字节, 说明)。formats 为服务商支持的图像格式。
+    截图：无损WebP/PNG；灰度文档：单通道JPEG；照片：有损WebP/JPEG。encoding 为 jpeg 时沿用RGB JPEG。
+    """
+    buffer = BytesIO()
+    if encoding != "auto":
+        image = image if image.mode == 'RGB' else image.convert('RGB')
+        image.save(buffer, format='JPEG', quality=quality, optimize=True)
+        return buffer.getvalue(), "JPEG"
+    kind, gray = classify_image(image)
+    target_mode = 'L' if gray else 'RGB'
+    if image.mode != target_mode:
+        image = image.convert(target_mode)
+    fmt = 'JPEG'
+    try:
+        if kind == "screenshot" and "WEBP" in formats:
+            fmt = 'WEBP'
+            image.save(buffer, format='WEBP', lossless=True, method=4)
+        elif kind == "screenshot":
+            fmt = 'PNG'
+            image.save(buffer, format='PNG')
+        elif kind == "photo" and "WEBP" in formats:
+            fmt = 'WEBP'
+            image.save(buffer, format='WEBP', quality=quality, method=4)
+    except Exception:
+        # 当前PIL不支持该编码时回退到JPEG
+        fmt = 'JPEG'
+        buffer = BytesIO()
+    if fmt == 'JPEG':
+        image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue(), f"{kind}/{fmt}/{image.mode}"
+
+def find_content_bbox(image):
+    """以四角像素的众数估计背景色，返回内容外接框 (x0, y0, x1, y1)；可裁掉的边缘不足5%面积时返回 None"""
+    w, h = image.size
+    corners = [image.getpixel(p) for p in ((0, 0), (w - 1, 0), (0, h - 1), (w - 1, h - 1))]
+    background = max(corners, key=corners.count)
+    diff = ImageChops.difference(image, Image.new(image.mode, image.size, background))
+    bands = diff.split()
+    # 忽略透明通道，取各颜色通道差值的最大值
+    if image.mode in ("RGBA", "LA"):
+        bands = bands[:-1]
+    mask = bands[0]
+    for band in bands[1:]:
+        mask = ImageChops.lighter(mask, band)
+    # 阈值化后做最小值滤波，去掉扫描噪点
+    mask = mask.point(lambda v: 255 if v > 24 else 0).filter(ImageFilter.MinFilter(3))
+    bbox = mask.getbbox()
+    if not bbox:
+        return None
+    pad = max(4, int(max(w, h) * 0.01))
+    x0, y0, x1, y1 = max(0, bbox[0] - pad), max(0, bbox[1] - pad), min(w, bbox[2] + pad), min(h, bbox[3] + pad)
+    if (x1 - x0) * (y1 - y0) >= 0.95 * w * h:
+        return None
+    return x0, y0, x1, y1
+
+def detect_text_lines(image, max_side=1600):
+    """轻量文本行检测（不做识别）：按与背景色的差异二值化，水平投影切出行带，行带内按列投影切出行段。
+    适用于横排文档与截图；返回原图坐标的四点框列表，按行从上到下、行内从左到右排列。
+    """
+    # draft() 会就地缩小 image.size，坐标需按解码前的原图尺寸换算
+    orig_w, orig_h = image.size
+    if image.format == "JPEG":
+        image.draft('L', (max_side, max_side))
+    gray = image.convert('L')
+    ratio = min(1.0, max_side / max(gray.size))
+    if ratio < 1.0:
+        gray = gray.resize((max(1, int(gray.size[0] * ratio)), max(1, int(gray.size[1] * ratio))), Image.Resampling.BOX)
+    ratio = gray.size[0] / orig_w
+    w, h = gray.size
+    corners = [gray.getpixel(p) for p in ((0, 0), (w - 1, 0), (0, h - 1), (w - 1, h - 1))]
+    background = max(corners, key=corners.count)
+    ink = ImageChops.difference(gray, Image.new('L', gray.size, background)).point(lambda v: 1 if v > 48 else 0).convert('F')
+
+    def runs(profile, eps, max_gap):
+        """连续非零区间，间隔不超过 max_gap 的合并"""
+        spans = []
+        for i, v in enumerate(profile):
+            if v > eps:
+                if spans and i - spans[-1][1] <= max_gap:
+                    spans[-1][1] = i + 1
+                else:
+                    spans.append([i, i + 1])
+        return spans
+
+    rows = list(ink.resize((1, h), Image.Resampling.BOX).getdata())
+    boxes = []
+    for top, bottom in runs(rows, 0.5 / w, 1):
+        band_h = bottom - top
+        if band_h < 4:
+            continue
+        cols = list(ink.crop((0, top, w, bottom)).resize((w, 1), Image.Resampling.BOX).getdata())
+        # 字间距通常小于一个字高，栏间距明显更大
+        for left, right in runs(cols, 0.5 / band_h, max(8, band_h * 2)):
+            if right - left < 3:
+                continue
+            x0, y0 = max(0, left - 1) / ratio, max(0, top - 1) / ratio
+            x1, y1 = min(w, right + 1) / ratio, min(h, bottom + 1) / ratio
+            boxes.append([[int(x0), int(y0)], [int(x1), int(y0)], [int(x1), int(y1)], [int(x0), int(y1)]])
+    return boxes
+
+def process_image(image, new_size, trim, quality, formats, encoding, passthrough):
+    """像素处理流水线：按比例解码、缩小、裁边、编码，可在子进程中运行。
+    new_size 为不裁边时的目标尺寸；passthrough 为真时若无可裁边缘返回 None（沿用原图）。
+    返回 (编码后字节, 处理后尺寸, 裁边偏移(原图像素), 说明)。
+    """
+    original_size = image.size
+    scale = new_size[0] / original_size[0]
+    # JPEG：利用DCT缩放（1/2、1/4、1/8）直接解码到不小于目标的尺寸，避免解码全分辨率
+    if image.format == "JPEG" and new_size != original_size:
+        image.draft('RGB', new_size)
+    # 调色板等模式不支持 reduce()，需先转换
+    if image.mode not in ("RGB", "RGBA", "L", "LA"):
+        image = image.convert('RGB')
+    # 大整数倍缩小先用 reduce() 盒式降采样，保留至少2倍余量给最终的高质量缩放
+    factor = int(min(image.size[0] / new_size[0], image.size[1] / new_size[1]) // 2)
+    if factor >= 2:
+        image = image.reduce(factor)
+    # 裁掉空白边缘，偏移量按原图像素记录，供坐标映射使用
+    crop_offset = (0, 0)
+    if trim:
+        bbox = find_content_bbox(image)
+        if bbox:
+            rx = image.size[0] / original_size[0]
+            ry = image.size[1] / original_size[1]
+            x0, y0, x1, y1 = bbox
+            image = image.crop(bbox)
+            crop_offset = (int(round(x0 / rx)), int(round(y0 / ry)))
+            new_size = (max(1, int((x1 - x0) / rx * scale)), max(1, int((y1 - y0) / ry * scale)))
+        elif passthrough:
+            return None
+    if image.size != new_size:
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+    encoded, desc = encode_image(image, quality, formats, encoding)
+    return encoded, new_size, crop_offset, desc
+
+def _process_image_in_subprocess(source, args):
+    """进程池入口：按文件路径或共享内存 (名称, 长度) 读取原始文件字节，像素只在子进程内解码"""
+    if isinstance(source, tuple):
+        try:
+            # 3.13+：只读取不登记，由父进程负责释放
+            shm = shared_memory.SharedMemory(name=source[0], track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=source[0])
+        try:
+            data = bytes(shm.buf[:source[1]])
+        finally:
+            shm.close()
+        image = Image.open(BytesIO(data))
+    else:
+        image = Image.open(source)
+    with image:
+        return process_image(image, *args)
+
+# 检测线程微基准结果（本进程内缓存，插件重启后沿用）：线程数上限 -> 选出的线程数
+_BENCHMARKED_THREADS = {}
+
+class DetectorWorker:
+    """常驻的Paddle检测线程：请求排队后在同一线程串行执行。
+    超时只从开始执行时计时；执行中超时视为检测器卡住，停止并在新线程中重建检测器，排队中的请求转交新线程，不会堆积卡住的线程。
+    """
+
+    def __init__(self, factory, lazy=False):
+        self.factory = factory  # 创建并启动检测器的函数，失败时抛出异常
+        self._lock = threading.Lock()
+        self._generation = None
+        self.healthy = True
+        # 非 lazy 时检测器在调用方线程创建，启动失败直接抛给调用方；lazy 时在检测线程中首次使用时创建
+        self._start_generation(None if lazy else factory())
+
+    def _start_generation(self, detector=None):
+        generation = {"queue": queue.Queue(), "detector": detector}
+        thread = threading.Thread(target=self._loop, args=(generation,), daemon=True, name="AIOCR-paddle")
+        self._generation = generation
+        thread.start()
+        return generation
+
+    def _loop(self, generation):
+        jobs = generation["queue"]
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            future, fn, started = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            started.set()
+            try:
+                if generation["detector"] is None:
+                    generation["detector"] = self.factory()
+                future.set_result(fn(generation["detector"]))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def call(self, fn, timeout=None):
+        """在检测线程中执行 fn(detector) 并返回结果；超时抛出 concurrent.futures.TimeoutError"""
+        future = concurrent.futures.Future()
+        started = threading.Event()
+        with self._lock:
+            if self._generation is None:
+                raise RuntimeError("PaddleOCR 检测器已停止")
+            generation = self._generation
+            generation["queue"].put((future, fn, started))
+        # 排队等待不计入超时：前一个请求卡住时会由其调用方重建检测线程
+        started.wait()
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            print(f"[AIOCR] Paddle检测器 {timeout}s 未响应，重启检测器")
+            self.restart(generation)
+            raise
+
+    def restart(self, generation):
+        """停止卡住的检测器，排队中的请求转交新的检测线程（新检测器在新线程中按需创建）"""
+        with self._lock:
+            if self._generation is not generation:
+                return
+            pending = []
+            while True:
+                try:
+                    pending.append(generation["queue"].get_nowait())
+                except queue.Empty:
+                    break
+            replacement = self._start_generation()
+            for job in pending:
+                replacement["queue"].put(job)
+            generation["queue"].put(None)
+        self._stop_detector(generation, background=True)
+
+    def recycle(self):
+        """重建检测器：停止当前检测器，之后的请求在新线程中使用新检测器"""
+        generation = self._generation
+        if generation is not None:
+            self.restart(generation)
+
+    def stop(self):
+        """停止检测线程与检测器，排队中的请求被取消"""
+        with self._lock:
+            generation, self._generation = self._generation, None
+        if generation is None:
+            return
+        while True:
+            try:
+                job = generation["queue"].get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job[0].cancel()
+                job[2].set()
+        generation["queue"].put(None)
+        self._stop_detector(generation)
+
+    def _stop_detector(self, generation, background=False):
+        detector = generation["detector"]
+        if detector is None or not hasattr(detector, 'stop'):
+            return
+        def _stop():
+            try:
+                detector.stop()
+            except Exception:
+                pass
+        # 卡住的检测器 stop() 也可能阻塞，放到后台线程
+        if background:
+            threading.Thread(target=_stop, daemon=True).start()
+        else:
+            _stop()
+
+class DetectorPool:
+    """多个常驻检测线程（各自一个检测器进程）：请求交给正在处理数最少的健康实例。
+    实例超时或出错后暂时移出调度，后台用一张小图做健康检查，通过后恢复；连续失败时重建该实例的检测器并退避复查。
+    全部不健康时仍按最空闲分配。
+    """
+
+    def __init__(self, factories, probe_timeout=20):
+        # 首个实例同步启动以便及时报错，其余在各自线程中首次使用时启动
+        self.workers = [DetectorWorker(factories[0])] + [DetectorWorker(f, lazy=True) for f in factories[1:]]
+        self.probe_timeout = probe_timeout
+        self._busy = {id(w): 0 for w in self.workers}
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def call(self, fn, timeout=None):
+        """在最空闲的健康实例上执行 fn(detector)"""
+        with self._lock:
+            candidates = [w for w in self.workers if w.healthy] or self.workers
+            worker = min(candidates, key=lambda w: self._busy[id(w)])
+            self._busy[id(worker)] += 1
+        try:
+            return worker.call(fn, timeout)
+        except concurrent.futures.CancelledError:
+            raise
+        except Exception:
+            self._mark_unhealthy(worker)
+            raise
+        finally:
+            with self._lock:
+                self._busy[id(worker)] -= 1
+
+    def _mark_unhealthy(self, worker):
+        with self._lock:
+            if not worker.healthy or self._stopped:
+                return
+            worker.healthy = False
+        threading.Thread(target=self._check, args=(worker,), daemon=True, name="AIOCR-paddle-check").start()
+
+    @staticmethod
+    def _probe(detector):
+        image = Image.new('RGB', (64, 32), 'white')
+        buffer = BytesIO()
+        image.save(buffer, format='PNG')
+        return detector.runBase64(base64.b64encode(buffer.getvalue()).decode('ascii'))
+
+    def _check(self, worker):
+        """健康检查：检测器能正常返回（含未识别到文字）即恢复调度。
+        每连续失败3次重建一次该实例的检测器，复查间隔从5秒退避到30秒起、最长5分钟，直到恢复或停止。
+        """
+        failures = 0
+        delay = 5
+        while not self._stopped:
+            try:
+                result = worker.call(DetectorPool._probe, self.probe_timeout)
+                if isinstance(result, dict) and result.get("code") in (100, 101):
+                    worker.healthy = True
+                    if failures >= 3:
+                        print("[AIOCR] Paddle检测器实例已恢复")
+                    return
+            except Exception:
+                pass
+            failures += 1
+            if failures % 3 == 0:
+                print(f"[AIOCR] Paddle检测器实例健康检查未通过，重建检测器，{max(30, delay * 2)}s 后复查")
+                worker.recycle()
+                delay = min(300, max(30, delay * 2))
+            time.sleep(delay)
+
+    def stop(self):
+        self._stopped = True
+        for worker in self.workers:
+            worker.stop()
+
+class ImageHolder:
+    """单次请求共享的图像：原始字节只读取一次、像素只完整解码一次，派生结果（如预处理后的编码）缓存在 cache 中，release() 后全部释放。
+    来源可以是 base64 文本、原始字节、文件路径或已解码的图像（多页文件的单页）；
+    来自文件时 PIL 直接按文件流式解码，base64 只在需要原样发送时才生成。
+    """
+
+    def __init__(self, image_base64=None, path=None, data=None, image=None, nbytes=None):
+        self._base64 = image_base64
+        self.path = path  # 来自 runPath 时的文件路径，进程池与Paddle可按路径读取
+        self.cache = {}
+        self._data = data
+        self._image = image
+        self._nbytes = nbytes
+        self._opened = [image] if image is not None else []
+
+    @property
+    def base64(self):
+        """base64 文本（按需生成）"""
+        if self._base64 is None:
+            if self._data is None and self._image is None and self.path:
+                self._base64 = self._encode_file()
+            else:
+                self._base64 = base64.b64encode(self.data).decode('ascii')
+        return self._base64
+
+    @property
+    def data(self):
+        """原始图像字节；来自文件时为只读内存映射，不复制到堆上"""
+        if self._data is None:
+            if self._base64 is None and self._image is not None and not self.path:
+                # 只有解码后的图像时无损编码为PNG
+                buffer = BytesIO()
+                self._image.save(buffer, format='PNG')
+                self._data = buffer.getvalue()
+            elif self._base64 is None and self.path:
+                with open(self.path, 'rb') as f:
+                    self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                raw = self._base64
+                if isinstance(raw, str) and raw.startswith("data:image"):
+                    raw = raw.split(",", 1)[-1]
+                self._data = base64.b64decode(raw)
+        return self._data
+
+    @property
+    def nbytes(self):
+        """原始图像字节数（来自文件时不读取内容）"""
+        if self._nbytes is not None:
+            return self._nbytes
+        if self._data is None and self._base64 is None and self.path:
+            return os.path.getsize(self.path)
+        return len(self.data)
+
+    @property
+    def image(self):
+        """完整解码的图像（首次访问时解码），调用方不得原地修改"""
+        if self._image is None:
+            image = self._open_source()
+            image.load()
+            self._image = image
+        return self._image
+
+    @property
+    def decoded(self):
+        """像素是否已在本进程完整解码"""
+        return self._image is not None
+
+    def open(self):
+        """供缩放流程使用的图像：已完整解码时复用（draft() 对其无效），否则只读文件头，可先 draft() 再按比例解码"""
+        if self._image is not None:
+            return self._image
+        return self._open_source()
+
+    def _open_source(self):
+        if self._data is None and self._base64 is None and self.path:
+            image = Image.open(self.path)
+        else:
+            image = Image.open(BytesIO(self.data))
+        self._opened.append(image)
+        return image
+
+    def _encode_file(self):
+        """分块读取文件并编码为 base64，块长为3的整数倍，编码结果直接写入预分配缓冲区"""
+        size = os.path.getsize(self.path)
+        out = bytearray(4 * ((size + 2) // 3))
+        pos = 0
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(3 * 256 * 1024)
+                if not chunk:
+                    break
+                encoded = base64.b64encode(chunk)
+                out[pos:pos + len(encoded)] = encoded
+                pos += len(encoded)
+        return out[:pos].decode('ascii') if pos != len(out) else out.decode('ascii')
+
+    def release(self):
+        for image in self._opened:
+            try:
+                image.close()
+            except Exception:
+                pass
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._opened = []
+        self._data = None
+        self._image = None
+        self.cache.clear()
+
+class ImageState:
+    """按线程隔离的单图状态属性（尺寸、缩放、偏移），并发识别与分块并行时各线程互不干扰"""
+
+    def __init__(self, default):
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return getattr(obj._image_state, self.name, self.default)
+
+    def __set__(self, obj, value):
+        setattr(obj._image_state, self.name, value)
+
 # 主API类
 class Api:
+    # 图像尺寸追踪变量（线程内有效）
+    original_size = ImageState(None)   # 保存原始图像尺寸
+    processed_size = ImageState(None)  # 保存预处理后的图像尺寸
+    scale_ratio = ImageState(1.0)      # 保存缩放比例
+    crop_offset = ImageState((0, 0))   # 保存裁掉空白边缘后的偏移（原图像素）
+    current_image = ImageState(None)   # 当前请求共享的 ImageHolder
+
     def __init__(self, globalArgd):
         self.provider = None
         self.http_client = None
         # 兼容新旧键名
         self.max_concurrent = globalArgd.get("z_max_concurrent", globalArgd.get("max_concurrent", 3))
         self.executor = None
+        # 图像预处理进程池（0为不使用），与网络并发数分开配置
+        self.preprocess_processes = int(globalArgd.get("z_preprocess_processes", 0))
+        self.process_pool = None
+        self._process_pool_lock = threading.Lock()
         
         # 保存全局配置
         self.global_config = globalArgd
         
-        # 添加图像尺寸追踪变量
-        self.original_size = None  # 保存原始图像尺寸
-        self.processed_size = None # 保存预处理后的图像尺寸
-        self.scale_ratio = 1.0     # 保存缩放比例
-        # 检测-识别双通道：PaddleOCR 检测器句柄
+        # 图像尺寸追踪变量的线程存储
+        self._image_state = threading.local()
+        # stop() 时置位：不再重试，等待中的重试立即结束
+        self._stop_event = threading.Event()
+        # Ollama 模型状态探测：上次探测时间、是否进行中、重新加载的退避
+        self._model_probe = {"at": 0, "running": False, "retry_at": 0, "delay": 0}
+        # stop() 暂存的检测器与HTTP客户端，供随后的 start() 复用
+        self._parked = None
+        # 检测-识别双通道：PaddleOCR 检测器实例池
         self.detector = None
+        self._detector_api = None
+        self._detector_lock = threading.RLock()
+        # 服务商拒绝结构化输出后置位，避免每次请求都先失败一次
+        self.structured_output_rejected = False
+        # 图像编码统计：上传字节数与节省量
+        self.stats = {"images": 0, "bytes_in": 0, "bytes_out": 0}
+        self._stats_lock = threading.Lock()
         
         # 兼容新旧键名：a_provider 或 provider
         provider = self.global_config.get('a_provider') or self.global_config.get('provider')
@@ -1166,99 +2172,638 @@ class Api:
         print(f"AI OCR 插件初始化完成，当前服务商: {provider}")
         
     def start(self, argd):
-        """启动API"""
+        """启动API（已启动时按新配置热更新，见 reconfigure）"""
+        if self.executor is not None:
+            return self.reconfigure(argd)
         try:
-            # 获取配置（兼容新旧键名）
-            provider_name = self.global_config.get("a_provider", self.global_config.get("provider", "openai"))
-            
-            # 根据选择的服务商获取对应的API密钥和模型
-            api_key = self.global_config.get(f"{provider_name}_api_key", "")
-            model = self.global_config.get(f"{provider_name}_model", "")
-            
-            # 获取自定义 API 地址（如果有的话）
-            api_base = self.global_config.get(f"{provider_name}_api_base", "")
-            
-            # 兼容新旧键名
-            timeout = self.global_config.get("a_timeout", self.global_config.get("timeout", 30))
-            proxy_url = self.global_config.get("z_proxy_url", self.global_config.get("proxy_url", ""))
+            self._stop_event.clear()
+            # 保存局部配置
+            self.local_config = argd
             
-            # 对于本地服务（Ollama、LM Studio），API密钥可以为空
-            if not api_key and provider_name not in ["ollama", "lmstudio"]:
-                return f"[Error] {provider_name} 的API密钥不能为空，请在设置中配置"
+            # 创建Provider，如果用户配置了自定义API地址则使用，否则使用默认值
+            self.provider = self._create_provider()
             
-            if not model:
-                return f"[Error] {provider_name} 的模型不能为空，请在设置中配置"
+            self.structured_output_rejected = False
+            self._health_cache = None
             
-            # 创建Provider，如果用户配置了自定义API地址则使用，否则使用默认值
-            self.provider = ProviderFactory.create_provider(
-                provider_name, api_key, api_base if api_base else None, model, timeout, proxy_url
-            )
+            # 取回 stop() 暂存的检测器与HTTP客户端（宿主修改设置时先 stop() 再 start()），配置未变则复用
+            parts = self._unpark()
             
             # 创建HTTP客户端
-            self.http_client = HTTPClient(timeout, proxy_url)
+            if self.http_client is None:
+                self.http_client = HTTPClient(*self._http_settings(self.global_config))
             
             # 创建线程池
             self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrent)
             
-            # 保存局部配置
-            self.local_config = argd
+            # 后台预热检测器与网络连接，不阻塞启动；复用的部分不再重复预热
+            self._start_warmup(parts)
             
             return ""
+        except ValueError as e:
+            return f"[Error] {str(e)}"
         except Exception as e:
             return f"[Error] 启动失败: {str(e)}"
+
+    def _create_provider(self):
+        """按当前配置创建Provider，配置不完整时抛出 ValueError"""
+        # 获取配置（兼容新旧键名）
+        provider_name = self.global_config.get("a_provider", self.global_config.get("provider", "openai"))
+        
+        # 根据选择的服务商获取对应的API密钥和模型
+        api_key = self.global_config.get(f"{provider_name}_api_key", "")
+        model = self.global_config.get(f"{provider_name}_model", "")
+        
+        # 获取自定义 API 地址（如果有的话）
+        api_base = self.global_config.get(f"{provider_name}_api_base", "")
+        timeout, proxy_url = self._http_settings(self.global_config)
+        
+        # 对于本地服务（Ollama、LM Studio），API密钥可以为空
+        if not api_key and provider_name not in ["ollama", "lmstudio"]:
+            raise ValueError(f"{provider_name} 的API密钥不能为空，请在设置中配置")
+        
+        if not model:
+            raise ValueError(f"{provider_name} 的模型不能为空，请在设置中配置")
+        
+        provider = ProviderFactory.create_provider(
+            provider_name, api_key, api_base if api_base else None, model, timeout, proxy_url
+        )
+        if isinstance(provider, OllamaProvider):
+            self._configure_ollama(provider)
+        return provider
+
+    @staticmethod
+    def _http_settings(config):
+        # 兼容新旧键名
+        timeout = config.get("a_timeout", config.get("timeout", 30))
+        proxy_url = config.get("z_proxy_url", config.get("proxy_url", ""))
+        return timeout, proxy_url
+
+    # 修改后需重建Paddle检测器的局部配置项
+    DETECTOR_OPTIONS = ("paddle_instances", "paddle_cpu_threads", "paddle_mkldnn", "paddle_ram_max", "paddle_ram_time")
+
+    def reconfigure(self, argd, globalArgd=None):
+        """热更新配置：对比新旧配置，只替换变化的部分（Provider、HTTP客户端、线程池、预处理进程池、检测器）。
+        未变化的部分原样保留：切换模型或语言时检测器与已建立的连接不受影响，进行中的请求继续用旧对象完成。
+        """
+        if self.executor is None:
+            if globalArgd is not None:
+                self.global_config = dict(globalArgd)
+            return self.start(argd)
+        old_global, old_local = self.global_config, self.local_config
+        new_global = dict(globalArgd) if globalArgd is not None else old_global
+        provider = new_global.get('a_provider') or new_global.get('provider') or 'openai'
+        new_global['a_provider'] = new_global['provider'] = provider
+
+        old_provider = self.provider
+        try:
+            self.global_config, self.local_config = new_global, argd
+            new_provider = self._create_provider()
+        except Exception as e:
+            self.global_config, self.local_config = old_global, old_local
+            return f"[Error] {str(e)}" if isinstance(e, ValueError) else f"[Error] 启动失败: {str(e)}"
+
+        changed = []
+        if self._provider_signature(new_provider) != self._provider_signature(old_provider):
+            self.provider = new_provider
+            self.structured_output_rejected = False
+            self._health_cache = None
+            self._model_probe = {"at": 0, "running": False, "retry_at": 0, "delay": 0}
+            changed.append("provider")
+            if isinstance(old_provider, OllamaProvider) and str(old_provider.keep_alive or "").startswith("-") and \
+                    (old_provider.model, old_provider.api_base) != (new_provider.model, new_provider.api_base):
+                # 换了模型：原先常驻的模型恢复为默认的空闲卸载时间
+                threading.Thread(target=self._release_ollama_model, args=(old_provider,), daemon=True).start()
+
+        if self._http_settings(new_global) != self._http_settings(old_global):
+            old_client, self.http_client = self.http_client, HTTPClient(*self._http_settings(new_global))
+            old_client.close()
+            changed.append("http_client")
+
+        max_concurrent = new_global.get("z_max_concurrent", new_global.get("max_concurrent", 3))
+        if max_concurrent != self.max_concurrent:
+            self.max_concurrent = max_concurrent
+            old_executor, self.executor = self.executor, concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent)
+            old_executor.shutdown(wait=False)
+            changed.append("executor")
+
+        processes = int(new_global.get("z_preprocess_processes", 0))
+        if processes != self.preprocess_processes:
+            with self._process_pool_lock:
+                self.preprocess_processes = processes
+                old_pool, self.process_pool = self.process_pool, None
+            if old_pool:
+                old_pool.shutdown(wait=False)
+            changed.append("process_pool")
+
+        if any(old_local.get(k) != argd.get(k) for k in self.DETECTOR_OPTIONS):
+            with self._detector_lock:
+                old_detector, self.detector = self.detector, None
+            if old_detector:
+                threading.Thread(target=old_detector.stop, daemon=True).start()
+            changed.append("detector")
+
+        print(f"[AIOCR] 配置已热更新，重建: {', '.join(changed) or '无'}")
+        # 只重新预热重建过的部分，其余沿用现有预热状态；模型只在 Provider 变化时重新加载，
+        # 什么都没变时不发起任何预热请求（新启用的预热项除外）
+        parts = set()
+        if "provider" in changed or "http_client" in changed:
+            parts.add("network")
+        if "provider" in changed:
+            parts.add("model")
+        if "detector" in changed:
+            parts.add("detector")
+        self._start_warmup(parts)
+        return ""
+
+    def _provider_signature(self, provider):
+        if provider is None:
+            return None
+        return (type(provider), provider.api_key, provider.api_base, provider.model, provider.timeout,
+                provider.proxy_url, getattr(provider, 'keep_alive', None), getattr(provider, 'num_ctx', 0))
+
+    def _release_ollama_model(self, provider):
+        """把常驻的 Ollama 模型恢复为默认的 5 分钟空闲卸载"""
+        try:
+            payload = provider.build_load_payload("5m")
+            url = f"{provider.api_base or provider.get_default_api_base()}/generate"
+            HTTPClient(3).post(url, provider.build_headers(), json.dumps(payload))
+        except Exception as e:
+            print(f"[AIOCR] 恢复 Ollama 模型保持时间失败: {e}")
     
+    def _configure_ollama(self, provider):
+        """设置 Ollama 的模型保持时间与上下文长度（会话内固定，避免因 num_ctx 变化重新加载模型）"""
+        provider.keep_alive = str(self.global_config.get("ollama_keep_alive", "-1")).strip() or None
+        num_ctx = int(self.global_config.get("ollama_num_ctx", 0) or 0)
+        if num_ctx <= 0:
+            # 按最大图像尺寸估算：图像token（未知计费方式时按每 28×28 像素1个token）+ 提示词 + 最大输出
+            max_size = int(self.local_config.get("max_image_size", 1536))
+            image_tokens = provider.estimate_image_tokens(max_size, max_size) or math.ceil(max_size / 28) ** 2
+            num_ctx = image_tokens + 2048 + max(OUTPUT_TOKEN_BUDGET.values())
+            num_ctx = -(-num_ctx // 2048) * 2048
+        provider.num_ctx = num_ctx
+        print(f"[AIOCR] Ollama keep_alive={provider.keep_alive} num_ctx={num_ctx}")
+
+    def _ollama_url(self, endpoint):
+        return f"{self.provider.api_base or self.provider.get_default_api_base()}/{endpoint}"
+
+    def _ollama_preload(self):
+        """通过不带提示词的 /api/generate 加载模型（已加载时仅刷新保持时间），返回是否成功"""
+        payload = self.provider.build_load_payload()
+        response = self.http_client.post(self._ollama_url("generate"), self.provider.build_headers(), json.dumps(payload))
+        if response['status_code'] != 200:
+            print(f"[AIOCR] Ollama 加载模型失败 (状态码: {response['status_code']}): {response['text'][:200]}")
+            return False
+        return True
+
+    def _ollama_loaded_model(self, http_client=None):
+        """健康探测：查询 /api/ps，返回当前模型的加载信息，未加载时返回 None"""
+        response = (http_client or self.http_client).get(self._ollama_url("ps"))
+        if response['status_code'] != 200:
+            raise Exception(f"查询 Ollama 状态失败 (状态码: {response['status_code']})")
+        model = self.provider.model
+        # 未写标签的模型名在 Ollama 中等同于 :latest
+        names = {model, model if ":" in model else f"{model}:latest"}
+        for entry in json.loads(response['text']).get("models", []):
+            if entry.get("name") in names or entry.get("model") in names:
+                return entry
+        return None
+
+    def _start_warmup(self, parts=None):
+        """后台预热：启动Paddle检测器；解析DNS并完成TLS握手，连接留给首个请求复用；
+        本地模型可选提前加载：Ollama 直接请求加载并按 keep_alive 保持，LM Studio 做一次极小推理。进度见 isReady()。
+        parts 为 None 时全部预热；否则只预热其中列出的项（network / model / detector）以及此前未预热过的项，
+        其余项保留现有状态。
+        """
+        local = self.local_config
+        provider_name = self.global_config.get("a_provider", self.global_config.get("provider", "openai"))
+        enabled = local.get("warmup", "on") == "on"
+        strategy = local.get('dual_strategy', 'ai_high_precision_with_coordinates')
+        needs_detector = (strategy != 'ai_high_precision_text_only' and local.get('dual_detector', 'paddle') != 'lite') or \
+            (local.get("blank_check", "off") != "off" and local.get("blank_check_paddle", "off") == "on")
+        needs_model = provider_name in ("ollama", "lmstudio") and local.get("warmup_inference", "on") == "on"
+        wanted = {"network": enabled, "detector": enabled and needs_detector, "model": enabled and needs_model}
+        old_state = getattr(self, 'warmup_state', {})
+        todo = set()
+        for key, want in wanted.items():
+            if want and (parts is None or key in parts or old_state.get(key, "skipped") == "skipped"):
+                todo.add(key)
+        self.warmup_state = {key: "pending" if key in todo else (old_state.get(key, "skipped") if wanted[key] else "skipped")
+                             for key in ("network", "detector", "model")}
+        if not todo:
+            return
+        provider = self.provider
+
+        def warm_network():
+            if "network" in todo:
+                try:
+                    ok = self.http_client.preconnect(self._get_request_url())
+                    self.warmup_state["network"] = "ready" if ok else "skipped"
+                except Exception as e:
+                    self.warmup_state["network"] = "failed"
+                    print(f"[AIOCR] 预连接失败: {e}")
+            if "model" not in todo or self.provider is not provider:
+                # 预热期间配置已被热更新，由新一轮预热加载新模型
+                return
+            if isinstance(provider, OllamaProvider):
+                self._warm_ollama_model()
+            else:
+                image = Image.new('RGB', (64, 32), 'white')
+                buffer = BytesIO()
+                image.save(buffer, format='PNG')
+                result = self._run_ocr(base64.b64encode(buffer.getvalue()).decode('ascii'), {"output_format": "text_only", "max_retries": 0})
+                self.warmup_state["model"] = "ready" if result.get("code") in (100, 101) else "failed"
+
+        def warm_detector():
+            try:
+                start_ts = time.time()
+                # 线程数微基准只在后台预热中运行，不占用检测器锁；完成前创建的检测器先用线程数上限
+                if int(local.get('paddle_cpu_threads', 0)) <= 0 and not self.detector:
+                    self._auto_cpu_threads(max(1, int(local.get('paddle_instances', 1))), benchmark=True)
+                self._ensure_paddle_detector()
+                self.warmup_state["detector"] = "ready"
+                print(f"[AIOCR] Paddle检测器预热完成，耗时 {round(time.time() - start_ts, 2)}s")
+            except Exception as e:
+                self.warmup_state["detector"] = "failed"
+                print(f"[AIOCR] Paddle检测器预热失败: {e}")
+
+        if todo & {"network", "model"}:
+            threading.Thread(target=warm_network, daemon=True, name="AIOCR-warmup-network").start()
+        if "detector" in todo:
+            threading.Thread(target=warm_detector, daemon=True, name="AIOCR-warmup-detector").start()
+
+    def _warm_ollama_model(self):
+        try:
+            start_ts = time.time()
+            ok = self._ollama_preload()
+            self.warmup_state["model"] = "ready" if ok else "failed"
+            if ok:
+                print(f"[AIOCR] Ollama 模型已加载，耗时 {round(time.time() - start_ts, 2)}s")
+        except Exception as e:
+            self.warmup_state["model"] = "failed"
+            print(f"[AIOCR] Ollama 模型加载失败: {e}")
+
+    # Ollama 模型状态探测的最短间隔（秒）；重新加载失败后的退避从30秒起、最长5分钟
+    MODEL_PROBE_INTERVAL = 10
+    MODEL_RELOAD_BACKOFF = (30, 300)
+
+    def isReady(self):
+        """预热状态：各项为 pending / ready / failed / skipped，ready 为真表示已无待完成的预热。
+        使用 Ollama 时在后台经 /api/ps 确认模型仍在内存中（model_loaded，最多每 MODEL_PROBE_INTERVAL 秒一次），
+        已被卸载则重新加载；本调用不等待探测，直接返回最近一次的结果。
+        """
+        warmup_state = getattr(self, 'warmup_state', {})
+        probe = self._model_probe
+        if isinstance(self.provider, OllamaProvider) and warmup_state.get("model") in ("ready", "failed") \
+                and not probe["running"] and time.time() - probe["at"] >= self.MODEL_PROBE_INTERVAL:
+            probe["running"] = True
+            threading.Thread(target=self._probe_ollama_model, args=(warmup_state,), daemon=True, name="AIOCR-model-probe").start()
+        state = dict(warmup_state)
+        state["ready"] = all(v != "pending" for v in state.values())
+        if isinstance(self.provider, OllamaProvider) and "model" in state and state["model"] != "skipped":
+            state["model_loaded"] = state["model"] == "ready"
+        return state
+
+    def _probe_ollama_model(self, warmup_state):
+        """后台探测 Ollama 模型是否仍已加载（短超时，Ollama 未启动时不长时间阻塞）；
+        未加载时重新加载，失败后按退避间隔重试，不会每次轮询都发起加载"""
+        probe = self._model_probe
+        try:
+            try:
+                loaded = self._ollama_loaded_model(HTTPClient(3, self.http_client.proxy_url)) is not None
+            except Exception as e:
+                print(f"[AIOCR] Ollama 健康探测失败: {e}")
+                loaded = False
+            if loaded:
+                warmup_state["model"] = "ready"
+                probe["delay"] = 0
+                return
+            if time.time() < probe["retry_at"] or self._stop_event.is_set():
+                # 退避期内或已 stop()：不重新加载
+                warmup_state["model"] = "failed"
+                return
+            warmup_state["model"] = "pending"
+            self._warm_ollama_model()
+            if warmup_state.get("model") == "ready":
+                probe["delay"] = 0
+            else:
+                low, high = self.MODEL_RELOAD_BACKOFF
+                probe["delay"] = min(high, max(low, probe["delay"] * 2))
+                probe["retry_at"] = time.time() + probe["delay"]
+                print(f"[AIOCR] Ollama 模型重新加载失败，{probe['delay']}s 后再试")
+        finally:
+            probe["at"] = time.time()
+            probe["running"] = False
+
+    # stop() 后检测器与空闲连接的保留秒数，期间 start() 且相关配置未变时直接复用
+    PARK_TIMEOUT = 30
+
     def stop(self):
-        """停止API"""
+        """停止API：排队任务直接取消，进行中的请求最多等待 z_stop_grace 秒，之后中断连接。
+        检测器与空闲连接暂存 PARK_TIMEOUT 秒，供随后的 start() 复用，超时未取回则在后台关闭。
+        """
+        if self.executor is None:
+            return
+        self._stop_event.set()
+        grace = float(self.global_config.get("z_stop_grace", 3))
         if self.executor:
-            self.executor.shutdown(wait=True)
+            self._shutdown_executor(self.executor)
             self.executor = None
-        # 关闭 PaddleOCR 检测器（若存在）
+        if self.process_pool:
+            self._shutdown_executor(self.process_pool)
+            self.process_pool = None
+        with self._detector_lock:
+            detector, self.detector = getattr(self, 'detector', None), None
+        client = self.http_client
+        if client:
+            client.shutdown(grace, keep_idle=True)
+        self._park(detector, client)
+        if isinstance(self.provider, OllamaProvider) and str(self.provider.keep_alive or "").startswith("-"):
+            # 常驻的模型恢复为 Ollama 默认的空闲卸载时间，不占用显存到 Ollama 重启
+            self._release_ollama_model(self.provider)
+
+    def _park(self, detector, client):
+        """暂存检测器与HTTP客户端，PARK_TIMEOUT 秒内未被 start() 取回则关闭"""
+        self._discard_parked()
+        if not detector and not client:
+            return
+        parked = {
+            "detector": detector,
+            "client": client,
+            "detector_options": {k: self.local_config.get(k) for k in self.DETECTOR_OPTIONS},
+            "http_settings": self._http_settings(self.global_config),
+            "provider": self._provider_signature(self.provider),
+        }
+        parked["timer"] = threading.Timer(self.PARK_TIMEOUT, self._discard_parked, args=(parked,))
+        parked["timer"].daemon = True
+        with self._detector_lock:
+            self._parked = parked
+        parked["timer"].start()
+
+    def _discard_parked(self, parked=None):
+        """关闭暂存的检测器与HTTP客户端；指定 parked 时只在它仍是当前暂存项时关闭"""
+        with self._detector_lock:
+            current = self._parked
+            if current is None or (parked is not None and parked is not current):
+                return
+            self._parked = None
+        current["timer"].cancel()
+        self._close_parked(current["detector"], current["client"])
+
+    @staticmethod
+    def _close_parked(detector, client):
+        # 卡住的检测器 stop() 可能阻塞，放到后台线程
+        if detector and hasattr(detector, 'stop'):
+            threading.Thread(target=detector.stop, daemon=True, name="AIOCR-paddle-stop").start()
+        if client:
+            client.close()
+
+    def _unpark(self):
+        """取回 stop() 暂存的检测器与HTTP客户端：相关配置未变的直接复用，变了的关闭。
+        返回仍需预热的部分（传给 _start_warmup）；没有暂存项时返回 None，即全部预热。
+        """
+        self.http_client = None
+        with self._detector_lock:
+            parked, self._parked = self._parked, None
+        if parked is None:
+            return None
+        parked["timer"].cancel()
+        detector, client = parked["detector"], parked["client"]
+        parts = {"network", "model", "detector"}
+        reused = []
+        if detector and parked["detector_options"] == {k: self.local_config.get(k) for k in self.DETECTOR_OPTIONS}:
+            with self._detector_lock:
+                self.detector, detector = detector, None
+            parts.discard("detector")
+            reused.append("detector")
+        if client and parked["http_settings"] == self._http_settings(self.global_config):
+            client.reopen()
+            self.http_client, client = client, None
+            reused.append("http_client")
+        self._close_parked(detector, client)
+        # stop() 已把常驻的 Ollama 模型恢复为空闲卸载，需要重新固定；其余情况模型未变则无需再次加载
+        pinned = isinstance(self.provider, OllamaProvider) and str(self.provider.keep_alive or "").startswith("-")
+        if parked["provider"] == self._provider_signature(self.provider) and not pinned:
+            parts.discard("model")
+        print(f"[AIOCR] 复用停止前的: {', '.join(reused) or '无'}")
+        return parts
+
+    @staticmethod
+    def _shutdown_executor(executor):
+        """不等待地关闭线程池/进程池并取消排队任务（Python 3.8 无 cancel_futures，只能不等待）"""
         try:
-            if hasattr(self, 'detector') and self.detector and hasattr(self.detector, 'stop'):
-                self.detector.stop()
-        except Exception:
-            pass
+            executor.shutdown(wait=False, cancel_futures=True)
+        except TypeError:
+            executor.shutdown(wait=False)
     
-    def testConnection(self):
-        """测试连接"""
+    # 轻量健康检查结果的缓存秒数
+    HEALTH_CHECK_TTL = 30
+
+    def testConnection(self, inference=False):
+        """测试连接：默认只查询模型列表（不计费，结果缓存 HEALTH_CHECK_TTL 秒）；
+        inference 为真或服务商不支持模型列表时，发送一次输出上限很小的真实推理。
+        """
         try:
-            # 创建一个简单的测试图像
-            test_image = Image.new('RGB', (100, 50), color='white')
-            buffer = BytesIO()
-            test_image.save(buffer, format='JPEG')
-            test_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
-            # 发送测试请求
-            result = self._run_ocr(test_base64, {"output_format": "text_only"})
-            
-            if result["code"] == 100 or result["code"] == 101:
-                return {"code": 100, "data": "连接测试成功"}
-            else:
-                return {"code": 102, "data": result["data"]}
+            if not inference:
+                cached = getattr(self, '_health_cache', None)
+                if cached and time.time() - cached[0] < self.HEALTH_CHECK_TTL:
+                    return cached[1]
+                result = self._check_models()
+                if result is not None:
+                    self._health_cache = (time.time(), result)
+                    return result
+            return self._check_inference()
         except Exception as e:
             return {"code": 102, "data": f"连接测试失败: {str(e)}"}
+
+    def _check_models(self):
+        """查询模型列表验证地址与密钥；接口不可用（404/405等）时返回 None"""
+        url = self.provider.get_models_url()
+        if not url:
+            return None
+        response = self.http_client.get(url, self.provider.build_headers())
+        status = response['status_code']
+        if status in (401, 403):
+            return {"code": 102, "data": f"连接测试失败: API密钥无效或无权限 (状态码: {status})"}
+        if status != 200:
+            print(f"[AIOCR] 模型列表接口不可用 (状态码: {status})，改用推理测试")
+            return None
+        found = self.provider.find_model(response['text'])
+        if found is False:
+            if isinstance(self.provider, OllamaProvider):
+                return {"code": 102, "data": f"连接测试失败: Ollama 中没有模型 {self.provider.model}，请先执行 ollama pull {self.provider.model}"}
+            return {"code": 100, "data": f"连接测试成功，但模型列表中未找到 {self.provider.model}，请确认模型名称"}
+        return {"code": 100, "data": "连接测试成功"}
+
+    def _check_inference(self):
+        """用极小的图片做一次最小推理，输出上限为16个token"""
+        test_image = Image.new('RGB', (32, 32), color='white')
+        buffer = BytesIO()
+        test_image.save(buffer, format='PNG')
+        test_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        payload = self.provider.cap_output_tokens(self.provider.build_payload(test_base64, "只回复 OK"), 16)
+        if isinstance(payload, dict) and payload.get("_mineru_error"):
+            raise Exception(payload.get("error_message", "MinerU 不支持此操作"))
+        response = self.http_client.post(self._get_request_url(), self.provider.build_headers(), json.dumps(payload))
+        if response['status_code'] != 200:
+            raise Exception(f"API请求失败 (状态码: {response['status_code']}): {response['text']}")
+        return {"code": 100, "data": "连接测试成功（已完成推理）"}
     
     def runPath(self, imgPath: str):
         """处理图片路径"""
         try:
-            with open(imgPath, 'rb') as f:
-                image_bytes = f.read()
-            return self.runBytes(image_bytes)
+            # 不整体读入：解码按文件流式读取，只有原样发送时才分块编码为 base64
+            if not os.path.isfile(imgPath):
+                raise FileNotFoundError(imgPath)
+            # 多页 TIFF 逐页识别；动图 GIF 默认只识别首帧，需显式选择 all
+            multi_page = getattr(self, 'local_config', {}).get("multi_page", "tiff")
+            formats = {"tiff": ("TIFF",), "all": ("TIFF", "GIF")}.get(multi_page, ())
+            if formats:
+                with Image.open(imgPath) as image:
+                    n_frames = getattr(image, "n_frames", 1)
+                    if n_frames > 1 and image.format in formats:
+                        return self._merge_page_results(self._iter_page_results(imgPath, image, n_frames))
+            return self._run_holder(ImageHolder(path=imgPath))
         except Exception as e:
             return self._create_error_result(f"读取图片失败: {str(e)}")
     
+    def _iter_page_results(self, path, image, n_frames):
+        """按页产出 (页码, 页面高度, 结果)：用 ImageSequence 逐页取帧，最多 max_concurrent 页同时在内存中处理，内存不随页数增长"""
+        workers = max(1, min(n_frames, int(self.max_concurrent)))
+        page_bytes = os.path.getsize(path) // n_frames
+        pending = collections.deque()
+        print(f"[AIOCR] 多页图像: {n_frames} 页，并发 {workers}")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            for index, frame in enumerate(ImageSequence.Iterator(image)):
+                # 前瞻已满时先取回最早一页的结果，再解码下一页
+                if len(pending) >= workers:
+                    number, height, future = pending.popleft()
+                    yield number, height, future.result()
+                holder = ImageHolder(image=frame.copy(), nbytes=page_bytes)
+                pending.append((index + 1, frame.size[1], pool.submit(self._run_holder, holder)))
+            while pending:
+                number, height, future = pending.popleft()
+                yield number, height, future.result()
+
+    def _merge_page_results(self, page_results):
+        """合并多页结果：各页自上而下纵向拼接到同一坐标系，后一页的纵坐标加上前面各页高度之和；
+        每个文本块另带 page 字段（从1开始）"""
+        data = []
+        errors = []
+        offset_y = 0
+        for number, height, result in page_results:
+            if result.get("code") == 100 and isinstance(result.get("data"), list):
+                for item in result["data"]:
+                    if offset_y and item.get("box"):
+                        item["box"] = [[x, y + offset_y] for x, y in item["box"]]
+                    item["page"] = number
+                    data.append(item)
+            elif result.get("code") == 102:
+                print(f"[AIOCR] 第 {number} 页识别失败: {result.get('data')}")
+                errors.append(result)
+            offset_y += height
+        if data:
+            return {"code": 100, "data": data}
+        return errors[0] if errors else self._create_empty_result()
+
     def runBytes(self, imageBytes):
         """处理图片字节流"""
         try:
-            image_base64 = base64.b64encode(imageBytes).decode('utf-8')
-            return self.runBase64(image_base64)
+            return self._run_holder(ImageHolder(data=imageBytes))
         except Exception as e:
             return self._create_error_result(f"处理图片字节流失败: {str(e)}")
     
     def _ensure_paddle_detector(self):
-        """加载并启动 PaddleOCR-json 检测器"""
-        if getattr(self, 'detector', None):
-            return
+        """启动 paddle_instances 个常驻检测实例，CPU线程数平均分配（首个检测器在当前线程创建，启动失败直接抛出）"""
+        with self._detector_lock:
+            if getattr(self, 'detector', None):
+                return
+            local = getattr(self, 'local_config', {})
+            instances = max(1, int(local.get('paddle_instances', 1)))
+            cpu_threads = int(local.get('paddle_cpu_threads', 0))
+            if cpu_threads <= 0:
+                cpu_threads = self._auto_cpu_threads(instances)
+            factories = [lambda: self._create_paddle_detector(cpu_threads) for _ in range(instances)]
+            self.detector = DetectorPool(factories)
+            print(f"[AIOCR] Paddle检测器: {instances} 个实例，每个 {cpu_threads} 线程")
+
+    def _auto_cpu_threads(self, instances, benchmark=False):
+        """自动选择每个检测实例的CPU线程数。
+        先为并发的AI请求（预处理、编码、收发）预留核心：每2个并发请求留1核，最多留一半；
+        剩余核心平均分给各实例作为上限。benchmark 为真时（仅后台预热）用微基准在上限内选吞吐最高的线程数，
+        结果缓存在模块级 _BENCHMARKED_THREADS；尚无基准结果时直接用上限。
+        """
+        cores = os.cpu_count() or 4
+        reserve = min(cores // 2, (int(self.max_concurrent) + 1) // 2)
+        max_threads = max(1, (cores - reserve) // instances)
+        if benchmark and max_threads not in _BENCHMARKED_THREADS:
+            _BENCHMARKED_THREADS[max_threads] = self._benchmark_cpu_threads(max_threads)
+        return _BENCHMARKED_THREADS.get(max_threads, max_threads)
+
+    def _benchmark_cpu_threads(self, max_threads):
+        """启动微基准：用合成文档页测量各线程数的单页检测耗时，线程数翻倍提速不足5%即停止，取最快（同等速度取较少线程）者"""
+        candidates = sorted({t for t in (1, 2, 4, 8, 16, 32) if t < max_threads} | {max_threads})
+        if len(candidates) == 1:
+            return max_threads
+        page = Image.new('L', (1240, 1754), 255)
+        draw = ImageDraw.Draw(page)
+        for row in range(24):
+            draw.text((100, 100 + row * 64), f"{row:02d} The quick brown fox jumps over the lazy dog 0123456789", fill=0)
+        buffer = BytesIO()
+        page.save(buffer, format='JPEG', quality=85)
+        sample = base64.b64encode(buffer.getvalue()).decode('ascii')
+        best_threads, best_cost = max_threads, None
+        for threads in candidates:
+            detector = None
+            try:
+                detector = self._create_paddle_detector(threads)
+                detector.runBase64(sample)  # 预热（模型加载、内存分配）
+                start_ts = time.time()
+                for _ in range(2):
+                    detector.runBase64(sample)
+                cost = (time.time() - start_ts) / 2
+            except Exception as e:
+                print(f"[AIOCR] 检测线程基准中断: {e}")
+                break
+            finally:
+                if detector is not None and hasattr(detector, 'stop'):
+                    detector.stop()
+            print(f"[AIOCR] 检测线程基准: {threads} 线程 {round(cost, 3)}s/页")
+            if best_cost is not None and cost >= best_cost * 0.95:
+                break
+            best_threads, best_cost = threads, cost
+        return best_threads
+
+    def _create_paddle_detector(self, cpu_threads=None):
+        """启动一个 PaddleOCR-json 检测器实例"""
+        DetectorApi = self._load_detector_api()
+        local = getattr(self, 'local_config', {})
+        try:
+            # 构造必要的全局参数，避免 KeyError；默认开启按内存占用回收检测器
+            default_global = {
+                'enable_mkldnn': local.get('paddle_mkldnn', 'on') == 'on',
+                'cpu_threads': cpu_threads or os.cpu_count() or 4,
+                'ram_max': int(local.get('paddle_ram_max', 1024)),
+                'ram_time': int(local.get('paddle_ram_time', 60)),
+            }
+            detector = DetectorApi(default_global)
+            # 启动引擎（局部参数可为空）
+            err = detector.start({})
+            if isinstance(err, str) and err.startswith('[Error]'):
+                raise RuntimeError(err)
+            return detector
+        except Exception as e:
+            raise RuntimeError(f"PaddleOCR 检测器启动失败: {e}")
+
+    def _load_detector_api(self):
+        """定位并导入 PPOCR_umi 的 Api 类（多个实例共用，只导入一次）"""
+        with self._detector_lock:
+            if self._detector_api is None:
+                self._detector_api = self._import_detector_api()
+            return self._detector_api
+
+    def _import_detector_api(self):
+        """查找并导入 PaddleOCR-json 检测器模块"""
         try:
             base_dir = os.path.dirname(__file__)
             plugins_root = os.path.normpath(os.path.join(base_dir, '..'))
@@ -1300,20 +2845,8 @@ class Api:
             DetectorApi = getattr(module, 'Api', None)
             if DetectorApi is None:
                 raise RuntimeError('PPOCR_umi.py 中未找到 Api 类')
-            # 构造必要的全局参数，避免 KeyError
-            default_global = {
-                'enable_mkldnn': True,
-                'cpu_threads': os.cpu_count() or 4,
-                'ram_max': -1,
-                'ram_time': 60,
-            }
-            self.detector = DetectorApi(default_global)
-            # 启动引擎（局部参数可为空）
-            err = self.detector.start({})
-            if isinstance(err, str) and err.startswith('[Error]'):
-                raise RuntimeError(err)
+            return DetectorApi
         except Exception as e:
-            self.detector = None
             raise RuntimeError(f"PaddleOCR 检测器启动失败: {e}")
 
     def _crop_by_box(self, img, box):
@@ -1367,28 +2900,108 @@ class Api:
             return '\n'.join(str(x) for x in parsed)
         return str(parsed)
 
+    def _get_correction_context_format(self):
+        """获取纠错上下文格式：优先使用服务商专属配置 {provider}_correction_context，其次为局部配置"""
+        provider_name = self.global_config.get("a_provider", self.global_config.get("provider", "openai"))
+        fmt = self.global_config.get(f"{provider_name}_correction_context") or getattr(self, 'local_config', {}).get('dual_context_format', 'lines')
+        return fmt if fmt in ('json', 'lines', 'lines_pos') else 'lines'
+
+    def _format_correction_context(self, filtered, ctx_format):
+        """将Paddle识别结果格式化为纠错上下文。
+        json：含四点坐标的JSON；lines：`序号<TAB>文本`；lines_pos：额外附带粗略的(行,列)位置提示。
+        """
+        if ctx_format == 'json':
+            candidates = [{"text": f["text"], "box": f["box"]} for f in filtered]
+            return json.dumps({"texts": candidates}, ensure_ascii=False)
+        hints = {}
+        if ctx_format == 'lines_pos':
+            # filtered 已按中心y排序：中心落在当前行首框范围内的视为同一行，行内按左边界x排列
+            rows = []
+            for idx, f in enumerate(filtered):
+                xs = [p[0] for p in f["box"]] or [0]
+                ys = [p[1] for p in f["box"]] or [f["center_y"]]
+                if rows and f["center_y"] <= rows[-1]["bottom"]:
+                    rows[-1]["members"].append((min(xs), idx))
+                else:
+                    rows.append({"bottom": max(ys), "members": [(min(xs), idx)]})
+            for r, row in enumerate(rows, 1):
+                for c, (_, idx) in enumerate(sorted(row["members"]), 1):
+                    hints[idx] = f"({r},{c})"
+        lines = []
+        for idx, f in enumerate(filtered):
+            text = (f.get("text") or "").replace("\r", " ").replace("\n", " ")
+            lines.append(f"{idx}\t{hints.get(idx, '')}{text}")
+        return "\n".join(lines)
+
+    def _estimate_tokens(self, text):
+        """粗略估算文本token数：CJK字符约1个token，其余约4个字符1个token"""
+        if not text:
+            return 0
+        cjk = len(re.findall(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]", text))
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def _parse_diff_lines(self, content, line_count):
+        """解析差异纠错输出（每行 `序号<TAB>文本`，或结构化输出的 changes 数组），返回 {序号: 文本}。
+        空输出表示无改动，返回空字典；格式或序号非法时返回 None。
+        """
+        if content is None:
+            return None
+        if not isinstance(content, str):
+            return None
+        pairs = []
+        stripped = content.strip()
+        if stripped.startswith(('{', '```json', '```JSON')):
+            # 结构化输出：{"changes": [{"index": 序号, "text": 文本}]}
+            data = self._extract_json_from_text(stripped)
+            if not isinstance(data, dict) or not isinstance(data.get("changes"), list):
+                return None
+            for item in data["changes"]:
+                if not isinstance(item, dict) or not isinstance(item.get("index"), int) or not isinstance(item.get("text"), str):
+                    return None
+                pairs.append((item["index"], item["text"]))
+        else:
+            for raw in stripped.splitlines():
+                line = raw.rstrip('\r')
+                if not line.strip() or line.strip().startswith('```'):
+                    continue
+                m = re.match(r"^\s*\[?(\d+)\]?(?:\t|\s*[:：]\s*|\s+)(.*)$", line)
+                if not m:
+                    return None
+                pairs.append((int(m.group(1)), m.group(2)))
+        changes = {}
+        for idx, text in pairs:
+            if idx < 0 or idx >= line_count or idx in changes:
+                return None
+            changes[idx] = text.strip()
+        return changes
+
 
     def _run_paddle_first_correction(self, image_base64):
-        """Paddle优先 + AI纠错：先本地识别行与框，再由AI校正文本。"""
-        try:
-            self._ensure_paddle_detector()
-        except Exception as e:
-            return {"code": 101, "data": f"[Error] {e}"}
+        """Paddle优先 + AI纠错：先本地识别行与框，再由AI校正文本。
+        dual_detector 为 lite 时只用内置的轻量行检测取框（不做本地识别），由AI按框逐行转写。
+        """
         local = getattr(self, 'local_config', {})
+        lite = local.get('dual_detector', 'paddle') == 'lite'
+        if not lite:
+            try:
+                self._ensure_paddle_detector()
+            except Exception as e:
+                return {"code": 101, "data": f"[Error] {e}"}
         max_boxes = int(local.get('dual_max_boxes', 30))
         min_area = int(local.get('dual_min_area', 0))
         # 1) 先用Paddle识别获得文本与坐标（增加超时回退）
         paddle_timeout = int(local.get('paddle_timeout', 20))
         start_ts = time.time()
         try:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as _executor:
-                future = _executor.submit(self.detector.runBase64, image_base64)
-                det = future.result(timeout=paddle_timeout)
+            if lite:
+                det = self._detect_lines_lite(image_base64)
+            else:
+                det = self._detect(image_base64, paddle_timeout)
             cost = round(time.time() - start_ts, 2)
-            print(f"[AIOCR] Paddle识别完成，耗时 {cost}s")
+            print(f"[AIOCR] {'轻量行检测' if lite else 'Paddle识别'}完成，耗时 {cost}s")
         except concurrent.futures.TimeoutError:
             print(f"[AIOCR] Paddle识别超时({paddle_timeout}s)，回退到AI直出")
-            return self._run_ocr(image_base64, self.local_config)
+            return self._run_ocr(self._preprocess_image(image_base64), self.local_config)
         except Exception as e:
             return {"code": 101, "data": f"Paddle识别异常: {str(e)}"}
         if not isinstance(det, dict) or det.get('code') != 100 or not isinstance(det.get('data'), list):
@@ -1448,14 +3061,24 @@ class Api:
         filtered.sort(key=lambda v: v['center_y'])
         if max_boxes > 0:
             filtered = filtered[:max_boxes]
+        # 无文字直接返回时不做图像预处理
+        if not filtered and local.get("blank_check", "off") != "off" and local.get("blank_check_paddle", "off") == "on":
+            print("[AIOCR] Paddle未检测到文字，跳过AI请求")
+            return self._create_empty_result()
+        # Paddle在原图上检测（坐标即原图坐标），发送给AI的图像按 max_image_size / image_quality 缩放重编码；
+        # AI直出坐标时由 _map_coordinates_to_original 按缩放比例映射回原图。
+        # 以较小行（第10百分位）的行高作为缩放的可读性下限
+        heights = sorted(max(p[1] for p in f["box"]) - min(p[1] for p in f["box"]) for f in filtered if f["box"])
+        text_height = heights[len(heights) // 10] if heights else None
+        ai_base64 = self._preprocess_image(image_base64, text_height)
         # 新增：提前获取语言，便于AI回退
         language = local.get("language", "auto")
         if not filtered:
             # Paddle未检测到有效框，改用AI直出
-            ai_only_coords = self._run_ocr(image_base64, {"output_format": "with_coordinates", "language": language})
+            ai_only_coords = self._run_ocr(ai_base64, {"output_format": "with_coordinates", "language": language})
             if isinstance(ai_only_coords, dict) and ai_only_coords.get("code") == 100 and isinstance(ai_only_coords.get("data"), list) and ai_only_coords.get("data"):
                 return ai_only_coords
-            ai_only_text = self._run_ocr(image_base64, {"output_format": "text_only", "language": language})
+            ai_only_text = self._run_ocr(ai_base64, {"output_format": "text_only", "language": language})
             if isinstance(ai_only_text, dict) and ai_only_text.get("code") == 100:
                 return ai_only_text
             return det
@@ -1463,34 +3086,115 @@ class Api:
         language = local.get("language", "auto")
         lang_map = {"auto": "自动检测语言","zh": "中文","en": "英文","ja": "日文","ko":"韩文","fr":"法文","de":"德文","es":"西班牙文","ru":"俄文","ar":"阿拉伯文"}
         lang_instruction = lang_map.get(language, "自动检测语言")
-        candidates = [{"text": f["text"], "box": f["box"]} for f in filtered]
+        # 只有检测框、没有本地文本时改为按位置转写：上下文只带序号与(行,列)，差异模式不适用
+        detect_only = not any(f["text"] for f in filtered)
+        ctx_format = 'lines_pos' if detect_only else self._get_correction_context_format()
         try:
-            ctx_json = json.dumps({"texts": candidates}, ensure_ascii=False)
+            ctx_text = self._format_correction_context(filtered, ctx_format)
         except Exception:
             # 构建纠错上下文失败，改用AI直出
-            ai_only_coords = self._run_ocr(image_base64, {"output_format": "with_coordinates", "language": language})
+            ai_only_coords = self._run_ocr(ai_base64, {"output_format": "with_coordinates", "language": language})
             if isinstance(ai_only_coords, dict) and ai_only_coords.get("code") == 100:
                 return ai_only_coords
-            return self._run_ocr(image_base64, {"output_format": "text_only", "language": language})
+            return self._run_ocr(ai_base64, {"output_format": "text_only", "language": language})
+        if ctx_format == 'json':
+            ctx_block = f"Paddle识别结果：```json\n{ctx_text}\n```"
+            index_note = "行序号为 texts 数组中的下标（从0开始）。\n"
+        else:
+            line_fmt = "序号<TAB>(行,列)文本" if ctx_format == 'lines_pos' else "序号<TAB>文本"
+            ctx_block = f"Paddle识别结果（每行格式：{line_fmt}）：\n```\n{ctx_text}\n```"
+            index_note = "行序号即Paddle识别结果每行开头的序号。\n"
+            if ctx_format == 'lines_pos':
+                index_note += "(行,列)仅为版面位置提示，不要输出。\n"
         variant_note = ("严格禁止对中文进行繁体/简体转换、全角/半角转换、字符归一化；混合繁简时保持混合状态。逐字抄写图像字符，不要重写。示例：不要把 '台灣里体干' 改为 '臺灣裏體幹'，也不要相反。\n" if language in ("auto", "zh") else "")
+        # 结构化输出：由服务商约束为JSON，避免解析失败引发的回退请求
+        structured = self._use_structured_output()
+        # 只有检测框时（轻量检测器或Paddle未给出文本）行序以检测框序号为准
+        order_ref = "检测框序号" if detect_only else "Paddle"
+        if structured:
+            output_note = f'以JSON输出：{{"lines": ["第1行文本", ...]}}，行数与顺序与{order_ref}一致，不要输出序号。\n'
+        else:
+            output_note = f"仅输出纯文本，每行一个，顺序与{order_ref}一致，不要输出序号。\n"
         prompt = (
             f"请基于这张图片和PaddleOCR的识别结果进行纠错，语言：{lang_instruction}。\n"
             "保持每行数量与顺序不变，只修正识别错误，保留标点与空格。\n"
-            + variant_note +
-            "仅输出纯文本，每行一个，顺序与Paddle一致。\n"
+            + variant_note
+            + output_note +
             "不要解释或添加其他内容。\n"
-            f"Paddle识别结果：```json\n{ctx_json}\n```"
+            + ctx_block
         )
+        if detect_only:
+            prompt = (
+                f"请识别这张图片中的文字，语言：{lang_instruction}。\n"
+                f"图中已检测到 {len(filtered)} 个文本行，按下列序号顺序逐行转写，每行对应一个检测框，(行,列)为版面位置提示，不要输出。\n"
+                + variant_note
+                + output_note +
+                "不要解释或添加其他内容。\n"
+                f"检测到的文本行（每行格式：序号<TAB>(行,列)）：\n```\n{ctx_text}\n```"
+            )
+        correction_mode = 'full' if detect_only else local.get('dual_correction_mode', 'full')
+        # 输出上限按行数与Paddle文本量估算（纠错输出与原文长度相近），仅检测时文本未知，按纯文本上限
+        if detect_only:
+            max_tokens = OUTPUT_TOKEN_BUDGET["text_only"]
+        else:
+            text_tokens = sum(self._estimate_tokens(f.get("text", "")) for f in filtered)
+            max_tokens = min(max(int(text_tokens * 1.5) + 16 * len(filtered) + 256, 512), OUTPUT_TOKEN_BUDGET["with_coordinates"])
         # 4) 发送请求并解析为统一格式（稳健映射：文本由AI，坐标用Paddle）
         try:
-            response_text = self._send_request(image_base64, prompt)
+            # 4.0 差异模式：AI仅返回改动行，解析失败时回退到整行输出
+            if correction_mode == 'diff':
+                diff_prompt = (
+                    f"请基于这张图片和PaddleOCR的识别结果进行纠错，语言：{lang_instruction}。\n"
+                    "只修正识别错误，保留标点与空格。\n"
+                    + variant_note
+                    + index_note
+                    + (
+                        '仅输出需要修改的行，以JSON输出：{"changes": [{"index": 序号, "text": "修正后的完整行文本"}]}。\n'
+                        "若所有行都无需修改，changes 为空数组。\n"
+                        if structured else
+                        "仅输出需要修改的行，每行格式为：序号<TAB>修正后的完整行文本。\n"
+                        "若所有行都无需修改，输出空内容。\n"
+                    ) +
+                    "不要输出未修改的行，不要解释或添加其他内容。\n"
+                    + ctx_block
+                )
+                print(f"[AIOCR] 纠错上下文格式: {ctx_format}，提示词约 {self._estimate_tokens(diff_prompt)} tokens")
+                start_ts = time.time()
+                response_text = self._send_request(ai_base64, diff_prompt, DIFF_CORRECTION_SCHEMA if structured else None, "ocr_changes", max_tokens)
+                print(f"[AIOCR] AI差异纠错请求耗时 {round(time.time() - start_ts, 2)}s")
+                parsed = self.provider.parse_response(response_text)
+                changes = self._parse_diff_lines(parsed, len(filtered))
+                if changes is not None:
+                    print(f"[AIOCR] AI差异纠错行数: {len(changes)} / Paddle行数: {len(filtered)}")
+                    result_data = []
+                    for idx, f in enumerate(filtered):
+                        text = changes.get(idx, f.get("text", ""))
+                        result_data.append({"text": text, "box": f["box"], "score": 1.0})
+                    return {"code": 100, "data": result_data}
+                print("[AIOCR] AI差异纠错解析失败，回退到整行输出")
+            print(f"[AIOCR] 纠错上下文格式: {ctx_format}，提示词约 {self._estimate_tokens(prompt)} tokens")
+            start_ts = time.time()
+            response_text = self._send_request(ai_base64, prompt, CORRECTION_SCHEMA if structured else None, "ocr_lines", max_tokens)
+            print(f"[AIOCR] AI纠错请求耗时 {round(time.time() - start_ts, 2)}s")
             parsed = self.provider.parse_response(response_text)
-            # 4.1 获取AI纠正的纯文本行（不依赖坐标结构）
-            text_only = self._convert_to_umi_format(parsed, {"output_format": "text_only"})
             ai_lines = []
+            # 4.1 结构化输出：直接读取 lines 数组
+            if parsed and isinstance(parsed, str) and parsed.lstrip().startswith(('{', '```')):
+                data = self._extract_json_from_text(parsed)
+                if isinstance(data, dict) and isinstance(data.get("lines"), list):
+                    ai_lines = [str(t) for t in data["lines"]]
+            # 4.1.1 获取AI纠正的纯文本行（不依赖坐标结构）
+            text_only = self._convert_to_umi_format(parsed, {"output_format": "text_only"}) if not ai_lines else None
             if isinstance(text_only, dict) and text_only.get("code") == 100 and isinstance(text_only.get("data"), list):
-                ai_lines = [item.get("text", "") for item in text_only.get("data") if isinstance(item, dict) and item.get("text")]
-            # 4.1.1 回退解析：若纯文本未提取到行，尝试解析JSON中的texts
+                # 纯文本解析把整段内容作为一项返回，按行拆开才能与检测框一一对应；
+                # 中间的空行保留（无法识别的框），否则其后各行都会错位，只去掉首尾空行
+                ai_lines = [line for item in text_only.get("data") if isinstance(item, dict) and item.get("text")
+                            for line in item["text"].splitlines()]
+                while ai_lines and not ai_lines[0].strip():
+                    ai_lines.pop(0)
+                while ai_lines and not ai_lines[-1].strip():
+                    ai_lines.pop()
+            # 4.1.2 回退解析：若纯文本未提取到行，尝试解析JSON中的texts
             if not ai_lines:
                 coord_fmt = self._convert_to_umi_format(parsed, {"output_format": "with_coordinates"})
                 if isinstance(coord_fmt, dict) and coord_fmt.get("code") == 100 and isinstance(coord_fmt.get("data"), list):
@@ -1500,7 +3204,7 @@ class Api:
             if len(ai_lines) == 0:
                 try:
                     print("[AIOCR] AI纠错为空，尝试AI直出(含坐标)匹配Paddle框")
-                    ai_only_coords = self._run_ocr(image_base64, {"output_format": "with_coordinates", "language": language})
+                    ai_only_coords = self._run_ocr(ai_base64, {"output_format": "with_coordinates", "language": language})
                     if isinstance(ai_only_coords, dict) and ai_only_coords.get("code") == 100 and isinstance(ai_only_coords.get("data"), list):
                         ai_text_count = sum(1 for it in ai_only_coords["data"] if isinstance(it, dict) and (it.get("text") or "").strip())
                         if ai_text_count > 0:
@@ -1508,7 +3212,7 @@ class Api:
                             if matched:
                                 return {"code": 100, "data": [{"text": m["text"], "box": m["box"], "score": m.get("score", 1.0)} for m in matched]}
                     print("[AIOCR] 坐标直出为空，尝试AI直出纯文本匹配Paddle框")
-                    ai_only_text = self._run_ocr(image_base64, {"output_format": "text_only", "language": language})
+                    ai_only_text = self._run_ocr(ai_base64, {"output_format": "text_only", "language": language})
                     if isinstance(ai_only_text, dict) and ai_only_text.get("code") == 100 and isinstance(ai_only_text.get("data"), list):
                         ai_text_count2 = sum(1 for it in ai_only_text["data"] if isinstance(it, dict) and (it.get("text") or "").strip())
                         if ai_text_count2 > 0:
@@ -1521,21 +3225,17 @@ class Api:
                 # 进一步回退：逐框裁剪并对每个框进行AI识别纠错
                 try:
                     print("[AIOCR] AI直出仍为空，开始逐框裁剪识别纠错")
-                    # 尝试解码原始图片
+                    # 取本次请求已解码的原始图片
                     try:
-                        raw_b64 = image_base64
-                        if isinstance(raw_b64, str) and raw_b64.startswith("data:image"):
-                            raw_b64 = raw_b64.split(",", 1)[-1]
-                        img = Image.open(BytesIO(base64.b64decode(raw_b64)))
+                        img = self._image_holder(image_base64).image
                     except Exception:
                         img = None
                     ai_crop_lines = []
                     if img:
                         for f in filtered:
                             crop = self._crop_by_box(img, f["box"])
-                            buf = BytesIO()
-                            crop.save(buf, format="PNG")
-                            crop_b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
+                            encoded, _ = self._encode_image(crop, 85)
+                            crop_b64 = base64.b64encode(encoded).decode("utf-8")
                             resp = self._run_ocr(crop_b64, {"output_format": "text_only", "language": language})
                             line_text = ""
                             if isinstance(resp, dict) and resp.get("code") == 100 and isinstance(resp.get("data"), list) and len(resp["data"]) > 0:
@@ -1564,18 +3264,21 @@ class Api:
             return det
         except Exception:
             # AI纠错流程异常，改用AI直出
-            ai_only_coords = self._run_ocr(image_base64, {"output_format": "with_coordinates", "language": language})
+            ai_only_coords = self._run_ocr(ai_base64, {"output_format": "with_coordinates", "language": language})
             if isinstance(ai_only_coords, dict) and ai_only_coords.get("code") == 100:
                 return ai_only_coords
-            return self._run_ocr(image_base64, {"output_format": "text_only", "language": language})
+            return self._run_ocr(ai_base64, {"output_format": "text_only", "language": language})
     def _run_paddle_fallback(self, image_base64):
         """Paddle回退模式：纯本地识别"""
+        paddle_timeout = int(getattr(self, 'local_config', {}).get('paddle_timeout', 20))
         try:
-            det = self.detector.runBase64(image_base64)
+            det = self._detect(image_base64, paddle_timeout)
             if isinstance(det, dict) and det.get('code') == 100:
                 return det
             else:
                 return {"code": 101, "data": "Paddle识别失败"}
+        except concurrent.futures.TimeoutError:
+            return {"code": 101, "data": f"Paddle识别超时({paddle_timeout}s)"}
         except Exception as e:
             return {"code": 101, "data": f"Paddle识别异常: {str(e)}"}
 
@@ -1663,66 +3366,359 @@ class Api:
         return results
     def runBase64(self, imageBase64):
         """处理base64图片"""
+        return self._run_holder(ImageHolder(imageBase64))
+
+    def _run_holder(self, holder):
+        """按识别策略处理一张图像；本次请求内各阶段共享 holder 的解码结果，请求结束时释放"""
+        self.current_image = holder
         try:
+            # 本地预检：空白页、分隔页不请求AI
+            if self._is_blank_image(holder):
+                return self._create_empty_result()
             # 根据识别策略选择流程（不再需要启用开关）
             if hasattr(self, 'local_config'):
                 strategy = self.local_config.get('dual_strategy', 'ai_high_precision_with_coordinates')
                 # 含位置版：Paddle检测框 + AI纠错文本
                 if strategy in ('ai_high_precision_with_coordinates', 'paddle_first_correction'):
-                    return self._run_paddle_first_correction(imageBase64)
+                    return self._run_paddle_first_correction(holder)
                 # 纯文本：整图AI识别（预处理后）
                 elif strategy == 'ai_high_precision_text_only':
                     local = getattr(self, 'local_config', {})
-                    processed_base64 = self._preprocess_image(imageBase64)
+                    if local.get("blank_check", "off") != "off" and local.get("blank_check_paddle", "off") == "on" and self._count_paddle_boxes(holder) == 0:
+                        print("[AIOCR] Paddle未检测到文字，跳过AI请求")
+                        return self._create_empty_result()
+                    # 超大图像分块识别（未开启或无需分块时返回 None）
+                    tiled = self._run_tiled_ocr(holder, self.local_config)
+                    if tiled is not None:
+                        return tiled
+                    processed_base64 = self._preprocess_image(holder)
                     # *** 修改：确保调用 _run_ocr 时传递 output_format: text_only ***
                     # (原代码) return self._run_ocr(processed_base64, {"output_format": "text_only", "language": local.get("language", "auto")})
                     # (优化) self.local_config 已经包含了 output_format，直接传递
                     return self._run_ocr(processed_base64, self.local_config)
                 # 兜底：未知或旧值（如 'ai_first'）均按含位置版处理
                 else:
-                    return self._run_paddle_first_correction(imageBase64)
+                    return self._run_paddle_first_correction(holder)
             # 预处理图像 (兜底情况)
-            processed_base64 = self._preprocess_image(imageBase64)
+            processed_base64 = self._preprocess_image(holder)
             # 执行OCR
             return self._run_ocr(processed_base64, self.local_config)
         except Exception as e:
             return self._create_error_result(f"OCR处理失败: {str(e)}")
+        finally:
+            self.current_image = None
+            holder.release()
+
+    def _image_holder(self, image_base64):
+        """取图像对应的 ImageHolder：image_base64 可直接是 ImageHolder；是当前请求原图的 base64 时返回共享对象，否则（如分块、裁剪）返回临时对象"""
+        if isinstance(image_base64, ImageHolder):
+            return image_base64
+        holder = self.current_image
+        if holder is not None and holder._base64 is image_base64:
+            return holder
+        return ImageHolder(image_base64)
     
-    def _preprocess_image(self, image_base64):
-        """预处理图像"""
+    def _detect_lines_lite(self, image_base64):
+        """内置轻量行检测，返回与Paddle一致的结果结构（text 为空）"""
+        boxes = detect_text_lines(self._image_holder(image_base64).open())
+        if not boxes:
+            return self._create_empty_result()
+        return {"code": 100, "data": [{"text": "", "box": box, "score": 1.0} for box in boxes]}
+
+    def _detect(self, image_base64, timeout=None):
+        """经常驻检测线程调用Paddle，超时抛出 concurrent.futures.TimeoutError；图像来自文件时按路径识别，免去 base64 编码"""
+        holder = self._image_holder(image_base64)
+
+        def run(detector):
+            if holder.path and hasattr(detector, 'runPath'):
+                return detector.runPath(holder.path)
+            return detector.runBase64(holder.base64)
+
+        return self.detector.call(run, timeout)
+
+    def _is_blank_image(self, image_base64):
+        """本地预检空白图像：在长边不超过1024的灰度缩略图上，灰度标准差或边缘密度低于 blank_check 灵敏度对应阈值时视为无文字"""
+        level = getattr(self, 'local_config', {}).get("blank_check", "off")
+        # (灰度标准差上限, 边缘像素占比上限)；A4页面上一个短词的边缘占比约为万分之三
+        thresholds = {"low": (1, 0.00002), "medium": (1.5, 0.00005), "high": (2.5, 0.0002)}
+        if level not in thresholds:
+            return False
+        try:
+            image = self._image_holder(image_base64).open()
+            if image.format == "JPEG":
+                image.draft('L', (1024, 1024))
+            image = image.convert('L')
+            image.thumbnail((1024, 1024))
+            stddev = ImageStat.Stat(image).stddev[0]
+            edges = image.filter(ImageFilter.FIND_EDGES).point(lambda v: 255 if v > 40 else 0)
+            # 去掉滤波在图像边界产生的伪边缘
+            if edges.size[0] > 4 and edges.size[1] > 4:
+                edges = edges.crop((2, 2, edges.size[0] - 2, edges.size[1] - 2))
+            density = ImageStat.Stat(edges).mean[0] / 255
+        except Exception:
+            return False
+        max_stddev, max_density = thresholds[level]
+        if stddev < max_stddev or density < max_density:
+            print(f"[AIOCR] 判定为空白图像（标准差 {round(stddev, 2)}，边缘密度 {round(density, 5)}），跳过AI请求")
+            return True
+        return False
+
+    def _count_paddle_boxes(self, image_base64):
+        """用Paddle检测文字框数量；检测器不可用、超时或出错时返回 None"""
+        try:
+            self._ensure_paddle_detector()
+            timeout = int(getattr(self, 'local_config', {}).get('paddle_timeout', 20))
+            det = self._detect(image_base64, timeout)
+        except Exception:
+            return None
+        if not isinstance(det, dict):
+            return None
+        # Umi-OCR 约定：101 为未识别到文字
+        if det.get('code') == 101:
+            return 0
+        if det.get('code') == 100 and isinstance(det.get('data'), list):
+            return len(det['data'])
+        return None
+
+    def _choose_image_scale(self, size, max_size, text_height=None):
+        """按服务商的图像计费方式选择缩放比例。
+        在不超过 max_size、且估算文字行高不低于 min_text_height 的范围内取图像token最少的尺寸，同等token下取最大尺寸。
+        text_height 为原图中的文字行高（来自Paddle检测框），缺省时按短边的1%保守估算。
+        """
+        width, height = size
+        long_edge = max(width, height)
+        max_scale = min(1.0, max_size / long_edge)
+        local = getattr(self, 'local_config', {})
+        if local.get("image_token_budget", "auto") == "off" or not self.provider:
+            return max_scale
+
+        def cost(scale):
+            return self.provider.estimate_image_tokens(max(1, int(width * scale)), max(1, int(height * scale)))
+
+        best_tokens = cost(max_scale)
+        if best_tokens is None:
+            return max_scale
+        if not text_height or text_height <= 0:
+            text_height = min(width, height) * 0.01
+        min_text_height = int(local.get("min_text_height", 16))
+        floor_scale = min(max_scale, min_text_height / text_height)
+        best_scale = max_scale
+        # 长边以8px为步长由大到小搜索，严格更少才替换，保证同等token取最大尺寸
+        edge = int(long_edge * max_scale) - 8
+        while edge >= long_edge * floor_scale and edge > 0:
+            tokens = cost(edge / long_edge)
+            if tokens < best_tokens:
+                best_scale, best_tokens = edge / long_edge, tokens
+            edge -= 8
+        if best_scale != max_scale:
+            print(f"[AIOCR] 按计费方式缩放: 长边 {int(long_edge * max_scale)} -> {int(long_edge * best_scale)}px，约 {cost(max_scale)} -> {best_tokens} tokens")
+        return best_scale
+
+    def _plan_tiles(self, size, full_width=False):
+        """规划分块：整图缩放到 max_image_size 后文字明显低于 min_text_height 时，按可读分辨率切成带10%重叠的分块。
+        full_width 为真时只切整宽的横条（纯文本输出按块拼接，左右分块会打乱行内顺序），缩放比例受宽度限制。
+        返回 (分块列表[(x0, y0, x1, y1)], 分块缩放比例)，无需分块时返回 None。
+        """
+        local = getattr(self, 'local_config', {})
+        if local.get("tile_mode", "off") != "auto":
+            return None
+        width, height = size
+        max_size = int(local.get("max_image_size", 1536))
+        whole_scale = min(1.0, max_size / max(width, height))
+        # 无检测框时按短边的1%估算行高，与 _choose_image_scale 一致
+        text_height = min(width, height) * 0.01
+        tile_scale = min(1.0, int(local.get("min_text_height", 16)) / max(text_height, 1))
+        if full_width:
+            tile_scale = min(tile_scale, max_size / width)
+        # 整图缩放仍有可读行高的3/4以上时不分块
+        if whole_scale >= tile_scale * 0.75:
+            return None
+        max_tiles = int(local.get("tile_max_count", 12))
+        while True:
+            edge = int(max_size / tile_scale)
+            overlap = int(edge * 0.1)
+            step = edge - overlap
+            cols = math.ceil((width - overlap) / step) if width > edge else 1
+            rows = math.ceil((height - overlap) / step) if height > edge else 1
+            if cols * rows <= max_tiles:
+                break
+            tile_scale *= 0.9
+        if cols * rows <= 1 or tile_scale <= whole_scale:
+            return None
+        tiles = []
+        for row in range(rows):
+            y0 = min(row * step, max(0, height - edge))
+            for col in range(cols):
+                x0 = min(col * step, max(0, width - edge))
+                tiles.append((x0, y0, min(width, x0 + edge), min(height, y0 + edge)))
+        return tiles, tile_scale
+
+    def _run_tiled_ocr(self, image_base64, config):
+        """超大图像分块识别：分块并发识别，坐标偏移回原图并去除重叠区的重复文本；未开启或无需分块时返回 None"""
         try:
-            # 解码图像获取尺寸信息
-            image_data = base64.b64decode(image_base64)
-            image = Image.open(BytesIO(image_data))
+            holder = self._image_holder(image_base64)
+            image = holder.open()
+            plan = self._plan_tiles(image.size, full_width=config.get("output_format", "text_only") != "with_coordinates")
+        except Exception:
+            return None
+        if not plan:
+            return None
+        tiles, tile_scale = plan
+        full_size = image.size
+        print(f"[AIOCR] 超大图像分块识别: {full_size[0]}x{full_size[1]} -> {len(tiles)} 块，缩放 {round(tile_scale, 3)}")
+        # 只解码一次；JPEG 可直接按分块缩放比例DCT解码
+        if image.format == "JPEG" and tile_scale < 1.0:
+            image.draft('RGB', (max(1, int(full_size[0] * tile_scale)), max(1, int(full_size[1] * tile_scale))))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert('RGB')
+        image.load()
+        ratio = image.size[0] / full_size[0]
+        quality = {"high": 95, "medium": 85, "low": 75}.get(config.get("image_quality", "auto"), 85)
+        encoded_sizes = []
+
+        def run_tile(tile):
+            x0, y0, x1, y1 = tile
+            crop = image.crop((int(x0 * ratio), int(y0 * ratio), int(x1 * ratio), int(y1 * ratio)))
+            size = (max(1, int((x1 - x0) * tile_scale)), max(1, int((y1 - y0) * tile_scale)))
+            if crop.size != size:
+                crop = crop.resize(size, Image.Resampling.LANCZOS)
+            encoded, _ = self._encode_image(crop, quality)
+            encoded_sizes.append(len(encoded))
+            # 分块线程内的单图状态：坐标按分块缩放还原后加上分块偏移，裁剪到整图范围
+            self.original_size = full_size
+            self.processed_size = size
+            self.scale_ratio = tile_scale
+            self.crop_offset = (x0, y0)
+            return self._run_ocr(base64.b64encode(encoded).decode('utf-8'), config)
+
+        workers = max(1, min(len(tiles), int(config.get("dual_max_workers", 3))))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_tile, tiles))
+        self._record_encode_stats(holder.nbytes, sum(encoded_sizes))
+
+        self.original_size = full_size
+        self.processed_size = full_size
+        self.scale_ratio = 1.0
+        self.crop_offset = (0, 0)
+        succeeded = [r for r in results if r.get("code") == 100 and isinstance(r.get("data"), list)]
+        if not succeeded:
+            errors = [r for r in results if r.get("code") == 102]
+            return errors[0] if errors else self._create_empty_result()
+        if len(succeeded) < len(results):
+            print(f"[AIOCR] 分块识别: {len(results) - len(succeeded)}/{len(results)} 块未返回结果")
+        if config.get("output_format", "text_only") == "with_coordinates":
+            items = self._dedupe_tile_items([item for r in succeeded for item in r["data"]])
+            return {"code": 100, "data": items}
+        texts = ["\n".join(item.get("text", "") for item in r["data"]) for r in succeeded]
+        return self._parse_text_only(self._merge_tile_texts(texts))
+
+    def _dedupe_tile_items(self, items):
+        """去除分块重叠区的重复文本：与已保留的框交叠超过较小框面积60%视为同一行，保留文本较长者（未被切断的一份）"""
+        def bounds(box):
+            try:
+                xs = [p[0] for p in box]
+                ys = [p[1] for p in box]
+                return min(xs), min(ys), max(xs), max(ys)
+            except Exception:
+                return None
+
+        kept = []
+        for item in sorted(items, key=lambda it: -len(str(it.get("text", "")))):
+            b = bounds(item.get("box"))
+            duplicate = False
+            if b:
+                area = max(1, (b[2] - b[0]) * (b[3] - b[1]))
+                for _, kb in kept:
+                    if not kb:
+                        continue
+                    iw = min(b[2], kb[2]) - max(b[0], kb[0])
+                    ih = min(b[3], kb[3]) - max(b[1], kb[1])
+                    if iw > 0 and ih > 0 and iw * ih >= 0.6 * min(area, max(1, (kb[2] - kb[0]) * (kb[3] - kb[1]))):
+                        duplicate = True
+                        break
+            if not duplicate:
+                kept.append((item, b))
+        # 恢复阅读顺序
+        kept.sort(key=lambda k: (k[1][1], k[1][0]) if k[1] else (0, 0))
+        return [item for item, _ in kept]
+
+    def _merge_tile_texts(self, texts):
+        """按横条自上而下拼接文本，去掉相邻横条在重叠区重复识别的行（前块末尾与后块开头最长的相同行序列）"""
+        merged = []
+        for text in texts:
+            lines = text.strip().splitlines()
+            if merged:
+                tail = [line.strip() for line in merged[-20:]]
+                head = [line.strip() for line in lines[:20]]
+                for k in range(min(len(tail), len(head)), 0, -1):
+                    if tail[-k:] == head[:k] and any(tail[-k:]):
+                        lines = lines[k:]
+                        break
+            merged.extend(lines)
+        return "\n".join(merged)
+
+    def _encode_image(self, image, quality):
+        """按当前服务商支持的格式与 image_encoding 配置编码，返回 (编码后字节, 说明)"""
+        formats = getattr(self.provider, 'supported_image_formats', BaseProvider.supported_image_formats)
+        return encode_image(image, quality, formats, getattr(self, 'local_config', {}).get("image_encoding", "auto"))
+
+    def _record_encode_stats(self, bytes_in, bytes_out):
+        """累计图像编码统计"""
+        with self._stats_lock:
+            self.stats["images"] += 1
+            self.stats["bytes_in"] += bytes_in
+            self.stats["bytes_out"] += bytes_out
+
+    def getStats(self):
+        """获取图像编码统计（含节省的上传字节数）"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+        return stats
+
+    def _preprocess_image(self, image_base64, text_height=None):
+        """预处理图像（text_height 为原图文字行高，用于计费感知缩放的可读性下限）。
+        同一请求内相同参数的结果缓存在 ImageHolder 中，回退流程重复调用时不再解码与编码。
+        """
+        holder = self._image_holder(image_base64)
+        cache_key = ("preprocess", text_height)
+        if cache_key in holder.cache:
+            result, self.original_size, self.processed_size, self.scale_ratio, self.crop_offset = holder.cache[cache_key]
+            return result
+        result = self._preprocess_image_uncached(holder, text_height)
+        holder.cache[cache_key] = (result, self.original_size, self.processed_size, self.scale_ratio, self.crop_offset)
+        return result
+
+    def _preprocess_image_uncached(self, holder, text_height):
+        try:
+            # 只读取文件头获取尺寸信息
+            bytes_in = holder.nbytes
+            image = holder.open()
             self.original_size = image.size
+            self.crop_offset = (0, 0)
             
             # 检查是否需要处理
             max_size = self.local_config.get("max_image_size", 1536)
             quality_setting = self.local_config.get("image_quality", "auto")
+            scale = self._choose_image_scale(image.size, max_size, text_height)
             
-            need_resize = max(image.size) > max_size
+            need_resize = scale < 1.0
             need_convert = image.mode != 'RGB'
+            need_reencode = image.format not in getattr(self.provider, 'supported_image_formats', BaseProvider.supported_image_formats)
             need_quality_adjust = quality_setting != "auto"
+            need_trim = self.local_config.get("auto_trim", "off") == "on"
+            need_process = need_resize or need_convert or need_reencode or need_quality_adjust
             
-            # 如果不需要任何处理，直接返回原图
-            if not (need_resize or need_convert or need_quality_adjust):
+            # 如果不需要任何处理，直接返回原图（Image.open 只读取了文件头，像素尚未解码）
+            if not (need_process or need_trim):
                 self.scale_ratio = 1.0
                 self.processed_size = self.original_size
-                return image_base64
+                self._record_encode_stats(bytes_in, bytes_in)
+                return holder.base64
             
-            # 只在需要时进行转换
-            if need_convert:
-                image = image.convert('RGB')
-            
-            # 只在需要时进行缩放
+            new_size = image.size
             if need_resize:
-                self.scale_ratio = max_size / max(image.size)
-                new_size = (int(image.size[0] * self.scale_ratio), int(image.size[1] * self.scale_ratio))
-                image = image.resize(new_size, Image.Resampling.LANCZOS)
-                self.processed_size = new_size
-            else:
-                self.scale_ratio = 1.0
-                self.processed_size = image.size
+                new_size = (max(1, int(image.size[0] * scale)), max(1, int(image.size[1] * scale)))
             
             # 只在需要时调整质量
             if need_quality_adjust:
@@ -1731,17 +3727,70 @@ class Api:
             else:
                 quality = 85
             
-            # 重新编码
-            buffer = BytesIO()
-            image.save(buffer, format='JPEG', quality=quality, optimize=True)
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
+            # 解码、缩放、裁边与编码（按内容选择格式与通道数）
+            formats = getattr(self.provider, 'supported_image_formats', BaseProvider.supported_image_formats)
+            args = (new_size, need_trim, quality, formats, self.local_config.get("image_encoding", "auto"), not need_process)
+            untrimmed_size = new_size
+            processed = self._run_image_pipeline(holder, args)
+            if processed is None:
+                self.scale_ratio = 1.0
+                self.processed_size = self.original_size
+                self._record_encode_stats(bytes_in, bytes_in)
+                return holder.base64
+            encoded, new_size, self.crop_offset, desc = processed
+            if new_size != untrimmed_size:
+                print(f"[AIOCR] 裁掉空白边缘: {self.original_size} -> 内容区 {int(new_size[0] / scale)}x{int(new_size[1] / scale)}，偏移 {self.crop_offset}")
+            self.scale_ratio = scale
+            self.processed_size = new_size
+            
+            self._record_encode_stats(bytes_in, len(encoded))
+            print(f"[AIOCR] 图像编码: {desc}，{bytes_in}B -> {len(encoded)}B")
+            return base64.b64encode(encoded).decode('utf-8')
             
         except Exception as e:
             # 预处理失败时保持原图
             self.processed_size = self.original_size
             self.scale_ratio = 1.0
-            return image_base64
+            self.crop_offset = (0, 0)
+            return holder.base64
     
+    def _get_process_pool(self):
+        """按需创建图像预处理进程池（z_preprocess_processes 为0时不使用）"""
+        if self.preprocess_processes <= 0:
+            return None
+        with self._process_pool_lock:
+            if self.process_pool is None:
+                self.process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.preprocess_processes)
+            return self.process_pool
+
+    def _run_image_pipeline(self, holder, args):
+        """执行 process_image：启用进程池时以文件路径或共享内存交给子进程，不序列化像素；进程池不可用时在本线程处理"""
+        pool = self._get_process_pool()
+        # 已解码的图像（如多页文件的单页）直接在本线程处理，避免把像素再交给子进程
+        if pool is not None and not holder.decoded:
+            shm = None
+            try:
+                if holder.path:
+                    source = holder.path
+                else:
+                    data = holder.data
+                    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+                    shm.buf[:len(data)] = data
+                    source = (shm.name, len(data))
+                return pool.submit(_process_image_in_subprocess, source, args).result()
+            except Exception as e:
+                # 子进程导入失败、序列化或共享内存出错等：停用进程池，本次及之后都在本线程处理
+                print(f"[AIOCR] 预处理进程池不可用，改为在本进程处理: {type(e).__name__}: {e}")
+                with self._process_pool_lock:
+                    self.preprocess_processes = 0
+                    self.process_pool = None
+                pool.shutdown(wait=False)
+            finally:
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+        return process_image(holder.open(), *args)
+
     def _run_ocr(self, image_base64, config):
         """执行OCR识别"""
         try:
@@ -1753,7 +3802,11 @@ class Api:
             
             for attempt in range(max_retries + 1):
                 try:
-                    response_text = self._send_request(image_base64, prompt)
+                    schema = None
+                    if config.get("output_format", "text_only") == "with_coordinates" and self._get_coord_output_format(config) == "json":
+                        schema = COORDINATES_SCHEMA
+                    max_tokens = OUTPUT_TOKEN_BUDGET.get(config.get("output_format", "text_only"), OUTPUT_TOKEN_BUDGET["text_only"])
+                    response_text = self._send_request(image_base64, prompt, schema, "ocr_texts", max_tokens)
                     
                     # 解析响应
                     parsed_content = self.provider.parse_response(response_text)
@@ -1765,9 +3818,10 @@ class Api:
                         return self._create_empty_result()
                         
                 except Exception as e:
-                    if attempt == max_retries:
+                    if attempt == max_retries or self._stop_event.is_set():
+                        raise e
+                    if self._stop_event.wait(1):  # 重试前等待，停止时立即结束
                         raise e
-                    time.sleep(1)  # 重试前等待
                     
         except Exception as e:
             return self._create_error_result(str(e))
@@ -1793,7 +3847,12 @@ class Api:
         
         lang_instruction = lang_map.get(language, "自动检测语言")
         
-        if output_format == "with_coordinates":
+        if output_format == "with_coordinates" and self._get_coord_output_format(config) == "compact":
+            # 紧凑坐标模式：每行一个框，输出量约为JSON的一半，截断时已输出的行仍可用
+            prompt = f"""识别图片文字并返回坐标，语言：{lang_instruction}
+每行输出一个文本框，格式：x0,y0,x1,y1<TAB>文字内容
+x0,y0为左上角、x1,y1为右下角，坐标为像素位置，图片左上角为原点。按阅读顺序逐行输出，不要输出JSON或其他内容。"""
+        elif output_format == "with_coordinates":
             # 坐标模式（JSON）保持不变
             prompt = f"""识别图片文字并返回坐标，语言：{lang_instruction}
 输出JSON格式：{{"texts": [{{"text": "文字内容", "box": [[x1,y1],[x2,y2],[x3,y3],[x4,y4]]}}]}}
@@ -1820,15 +3879,16 @@ class Api:
         
         return prompt
     
-    def _send_request(self, image_base64, prompt):
-        """发送API请求"""
-        # 关键日志：记录提供商、模型与超时，便于定位卡顿
-        try:
-            provider_name = self.global_config.get("a_provider", self.global_config.get("provider", "unknown"))
-        except Exception:
-            provider_name = "unknown"
-        print(f"[AIOCR] 调用 {provider_name} / 模型 {getattr(self.provider, 'model', None)} / 超时 {getattr(self.http_client, 'timeout', None)}s")
-        # 构建请求URL
+    def _use_structured_output(self):
+        """当前服务商是否启用结构化输出（局部配置 structured_output，服务商拒绝后本次会话内自动停用）"""
+        if getattr(self, 'local_config', {}).get("structured_output", "auto") == "off":
+            return False
+        if getattr(self, 'structured_output_rejected', False):
+            return False
+        return bool(getattr(self.provider, 'supports_response_schema', False))
+
+    def _get_request_url(self):
+        """构建请求URL"""
         api_base = self.provider.api_base or self.provider.get_default_api_base()
         provider_name = self.global_config.get("a_provider", self.global_config.get("provider", "openai"))
         
@@ -1847,15 +3907,37 @@ class Api:
             url = f"{api_base}/chat/completions"  # Mistral OCR专用端点
         else:
             url = f"{api_base}/chat/completions"
+        return url
+
+    def _send_request(self, image_base64, prompt, schema=None, schema_name="ocr_result", max_tokens=None):
+        """发送API请求（schema 非空且服务商支持时请求结构化输出；max_tokens 为按任务估算的输出上限）"""
+        # 关键日志：记录提供商、模型与超时，便于定位卡顿
+        try:
+            provider_name = self.global_config.get("a_provider", self.global_config.get("provider", "unknown"))
+        except Exception:
+            provider_name = "unknown"
+        print(f"[AIOCR] 调用 {provider_name} / 模型 {getattr(self.provider, 'model', None)} / 超时 {getattr(self.http_client, 'timeout', None)}s")
+        url = self._get_request_url()
         
         # 构建请求头和载荷
         headers = self.provider.build_headers()
         payload = self.provider.build_payload(image_base64, prompt)
+        if max_tokens:
+            payload = self.provider.apply_output_limit(payload, max_tokens)
         
         # 检查是否是 MinerU 的错误情况
         if isinstance(payload, dict) and payload.get("_mineru_error"):
             # MinerU 不支持直接图片 OCR，返回错误信息
             raise Exception(payload.get("error_message", "MinerU 不支持此操作"))
+        elif schema is not None and self._use_structured_output():
+            structured_payload = self.provider.apply_response_schema(dict(payload), schema_name, schema)
+            response = self.http_client.post(url, headers, json.dumps(structured_payload))
+            if response['status_code'] == 400 and re.search(r"response_?(format|schema|mime_?type)|json_?schema", response['text'], re.I):
+                # 模型不支持结构化输出：停用并以普通请求重试，提示词本身已约定JSON格式；
+                # 图像过大、密钥或额度等其他400错误照常报错，不影响后续请求
+                print(f"[AIOCR] {provider_name} 拒绝结构化输出，改用普通请求: {response['text'][:200]}")
+                self.structured_output_rejected = True
+                response = self.http_client.post(url, headers, json.dumps(payload))
         else:
             # 所有服务商使用标准 JSON 请求
             response = self.http_client.post(url, headers, json.dumps(payload))
@@ -1870,31 +3952,52 @@ class Api:
         output_format = config.get("output_format", "text_only")
         
         if output_format == "with_coordinates":
+            if self._get_coord_output_format(config) == "compact":
+                compact = self._parse_compact_coordinates(content)
+                if compact:
+                    return compact
             return self._parse_text_with_coordinates(content)
         else:
             return self._parse_text_only(content)
 
+    def _get_coord_output_format(self, config):
+        """坐标输出格式：json（四点框JSON）或 compact（每行 x0,y0,x1,y1<TAB>文字）"""
+        return config.get("coord_output_format", getattr(self, 'local_config', {}).get("coord_output_format", "json"))
+
+    def _parse_compact_coordinates(self, content):
+        """解析紧凑坐标格式输出，坐标映射回原图；未解析出任何行时返回 None"""
+        if not isinstance(content, str):
+            return None
+        parser = CompactCoordinateParser()
+        parser.feed(content)
+        items = parser.finish()
+        if not items:
+            return None
+        result_data = []
+        for item in items:
+            x0, y0, x1, y1 = item["rect"]
+            mapped_box = self._map_coordinates_to_original({"x1": x0, "y1": y0, "x2": x1, "y2": y1})
+            result_data.append({"text": item["text"], "box": mapped_box, "score": 1.0})
+        return {"code": 100, "data": result_data}
+
     def _extract_json_from_text(self, content):
-        """从混杂文本中尽力提取JSON块（支持代码块与原始文本）"""
+        """从混杂文本中尽力提取JSON块（支持代码块、原始文本与被截断的输出）"""
         try:
             if not isinstance(content, str):
                 content = str(content)
             s = content.strip()
             # 1) 直接是JSON
             if s.startswith('{'):
-                return json.loads(s)
-            # 2) 代码块中的JSON
-            m = re.search(r"```(?:json|JSON)?\s*(\{[\s\S]*?\})\s*```", content)
-            if m:
-                return json.loads(m.group(1))
-            # 3) 文本里第一段花括号内容
-            m2 = re.search(r"(\{[\s\S]*\})", content)
-            if m2:
-                candidate = m2.group(1)
-                return json.loads(candidate)
+                try:
+                    return json.loads(s)
+                except Exception:
+                    pass
+            # 2) 单遍扫描：跳过代码块标记与说明文字定位首个完整对象；输出被截断时恢复 texts 中已完整的条目
+            scanner = JSONObjectScanner()
+            scanner.feed(s)
+            return scanner.value()
         except Exception:
             return None
-        return None
 
     def _parse_text_with_coordinates(self, content):
         """解析带坐标的文本"""
@@ -1995,6 +4098,10 @@ class Api:
             if self.scale_ratio and self.scale_ratio != 1.0:
                 x = x / self.scale_ratio
                 y = y / self.scale_ratio
+            # 加回裁掉的空白边缘偏移
+            if self.crop_offset:
+                x += self.crop_offset[0]
+                y += self.crop_offset[1]
             return clamp_xy(x, y)
         
         def poly_from_xywh(x, y, w, h):
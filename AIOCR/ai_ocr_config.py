@@ -150,6 +150,17 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("阿里云百炼模型名称，如：qwen-vl-plus-2025-08-15"),
     },
+    "alibaba_correction_context": {
+        "title": tr("阿里云百炼 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
 
     # 豆包配置
     "doubao_api_key": {
@@ -164,6 +175,17 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("豆包模型名称，如：Doubao-1.5-vision-pro-32k"),
     },
+    "doubao_correction_context": {
+        "title": tr("豆包 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
 
     # Google Gemini配置
     "gemini_api_key": {
@@ -178,6 +200,17 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("Gemini模型名称，如：gemini-2.5-flash, gemini-1.5-pro"),
     },
+    "gemini_correction_context": {
+        "title": tr("Gemini 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
 
     # OpenAI配置
     "openai_api_key": {
@@ -192,6 +225,17 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("OpenAI模型名称，如：gpt-5-mini, gpt-4o"),
     },
+    "openai_correction_context": {
+        "title": tr("OpenAI 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
 
     # OpenRouter配置
     "openrouter_api_key": {
@@ -206,6 +250,17 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("OpenRouter模型名称，如：anthropic/claude-3.5-sonnet, google/gemini-pro-vision"),
     },
+    "openrouter_correction_context": {
+        "title": tr("OpenRouter 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
 
     # 硅基流动配置
     "siliconflow_api_key": {
@@ -220,6 +275,17 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("硅基流动模型名称，如：Qwen/Qwen2.5-VL-32B-Instruct, Qwen/Qwen2.5-VL-72B-Instruct"),
     },
+    "siliconflow_correction_context": {
+        "title": tr("硅基流动 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
 
     # xAI配置
     "xai_api_key": {
@@ -234,6 +300,17 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("xAI模型名称，如：grok-4"),
     },
+    "xai_correction_context": {
+        "title": tr("xAI 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
 
     # 智谱AI配置
     "zhipu_api_key": {
@@ -248,6 +325,17 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("智谱AI模型名称，如：glm-4v-flash, glm-4v"),
     },
+    "zhipu_correction_context": {
+        "title": tr("智谱AI 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
 
     # Ollama配置（本地）
     "ollama_api_key": {
@@ -262,6 +350,31 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("Ollama本地视觉模型，如：llava:latest"),
     },
+    "ollama_correction_context": {
+        "title": tr("Ollama 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
+    "ollama_keep_alive": {
+        "title": tr("Ollama 模型保持时间"),
+        "default": "-1",
+        "type": "text",
+        "toolTip": tr("模型空闲后在显存中保留多久，如 30m、2h；-1 为插件运行期间常驻，停止插件后恢复为 Ollama 默认的 5 分钟。"),
+    },
+    "ollama_num_ctx": {
+        "title": tr("Ollama 上下文长度"),
+        "default": 0,
+        "min": 0,
+        "max": 131072,
+        "isInt": True,
+        "toolTip": tr("0为按最大图像尺寸自动估算。同一会话内保持不变，避免 Ollama 因上下文长度变化重新加载模型。"),
+    },
 
     # LM Studio配置（本地）
     "lmstudio_api_key": {
@@ -276,6 +389,17 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("LM Studio本地视觉模型，如：llava:latest"),
     },
+    "lmstudio_correction_context": {
+        "title": tr("LM Studio 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
 
     # Groq配置
     "groq_api_key": {
@@ -290,6 +414,17 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("Groq视觉模型名称，如：meta-llama/llama-4-scout-17b-16e-instruct"),
     },
+    "groq_correction_context": {
+        "title": tr("Groq 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
 
     # 无问芯穷配置
     "infinigence_api_key": {
@@ -304,6 +439,17 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("无问芯穷视觉模型名称，如：MiniCPM-V-2.6"),
     },
+    "infinigence_correction_context": {
+        "title": tr("无问芯穷 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
 
     # Mistral配置
     "mistral_api_key": {
@@ -318,6 +464,17 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("Mistral视觉模型名称，如：pixtral-12b-2409, mistral-large-latest"),
     },
+    "mistral_correction_context": {
+        "title": tr("Mistral 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
 
     # 新增：魔搭配置
     "modelscope_api_key": {
@@ -332,6 +489,17 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("魔搭模型ID，如：Qwen/Qwen-VL-Plus, Qwen/QVQ-72B-Preview"),
     },
+    "modelscope_correction_context": {
+        "title": tr("魔搭 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
     # 新增：浦源书生配置
     "intern_api_key": {
         "title": tr("浦源书生 API密钥"),
@@ -345,6 +513,17 @@ globalOptions = {
         "type": "text",
         "toolTip": tr("浦源书生多模态模型，如：internvl3.5-241b-a28b"),
     },
+    "intern_correction_context": {
+        "title": tr("浦源书生 纠错上下文格式"),
+        "default": "",
+        "optionsList": [
+            ["", tr("跟随识别设置")],
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("双通道纠错时发送给该服务商的Paddle上下文格式，覆盖识别设置中的“纠错上下文格式”。"),
+    },
 
     # 使用 z_ 前缀确保高级设置排在最后
     "z_proxy_url": {
@@ -364,6 +543,26 @@ globalOptions = {
         "toolTip": tr("批量处理时的最大并发请求数。"),
         "advanced": True,
     },
+    "z_preprocess_processes": {
+        "title": tr("预处理进程数"),
+        "default": 0,
+        "min": 0,
+        "max": 16,
+        "unit": tr("个"),
+        "isInt": True,
+        "toolTip": tr("在独立进程中解码、缩放和编码图像，避免大批量任务时预处理占满网络请求线程。0为不使用；与最大并发数分开配置，修改后需重启插件。"),
+        "advanced": True,
+    },
+    "z_stop_grace": {
+        "title": tr("停止等待时间"),
+        "default": 3,
+        "min": 0,
+        "max": 60,
+        "unit": tr("秒"),
+        "isInt": True,
+        "toolTip": tr("停止插件时等待进行中的请求完成的最长时间，超时后中断连接并立即返回；排队中的任务直接取消。"),
+        "advanced": True,
+    },
 }
 
 # 局部配置项
@@ -380,6 +579,24 @@ localOptions = {
         ],
         "toolTip": tr("选择识别策略：含位置高精度或纯文本高精度。"),
     },
+    "warmup": {
+        "title": tr("启动时预热"),
+        "default": "on",
+        "optionsList": [
+            ["on", tr("开启")],
+            ["off", tr("关闭")],
+        ],
+        "toolTip": tr("启动后在后台加载Paddle检测器、完成DNS解析与TLS握手，首次识别不再等待冷启动。"),
+    },
+    "warmup_inference": {
+        "title": tr("预热本地模型"),
+        "default": "on",
+        "optionsList": [
+            ["on", tr("开启")],
+            ["off", tr("关闭")],
+        ],
+        "toolTip": tr("使用本地模型时，启动后提前把模型加载到内存：Ollama 直接请求加载并按保持时间常驻，LM Studio 用一张极小的图片做一次推理。"),
+    },
     
     "language": {
         "title": tr("识别语言"),
@@ -408,6 +625,26 @@ localOptions = {
         ],
         "toolTip": tr("选择OCR结果的输出格式。坐标信息可用于定位文字位置。"),
     },
+
+    "coord_output_format": {
+        "title": tr("坐标输出格式"),
+        "default": "json",
+        "optionsList": [
+            ["json", tr("JSON四点框")],
+            ["compact", tr("紧凑行格式")],
+        ],
+        "toolTip": tr("AI直出坐标时的返回格式。紧凑行格式（x0,y0,x1,y1<TAB>文字）输出量约减半，输出被截断时已返回的行仍可使用。"),
+    },
+
+    "structured_output": {
+        "title": tr("结构化输出"),
+        "default": "auto",
+        "optionsList": [
+            ["auto", tr("服务商支持时启用")],
+            ["off", tr("关闭")],
+        ],
+        "toolTip": tr("对坐标与纠错请求使用服务商的JSON Schema/JSON模式（OpenAI、Gemini、Ollama、Mistral、Groq），减少解析失败导致的重复请求。模型不支持时自动关闭。"),
+    },
     
     "image_quality": {
         "title": tr("图像质量"),
@@ -420,6 +657,16 @@ localOptions = {
         ],
         "toolTip": tr("当需要重编码时，选择JPEG质量等级。"),
     },
+
+    "image_encoding": {
+        "title": tr("图像编码"),
+        "default": "auto",
+        "optionsList": [
+            ["auto", tr("按内容自适应")],
+            ["jpeg", tr("始终JPEG")],
+        ],
+        "toolTip": tr("重编码时按内容选择格式：截图用无损PNG/WebP，灰度文档用单通道JPEG，照片用JPEG/WebP，以减少上传字节数。"),
+    },
     
     "max_image_size": {
         "title": tr("最大图像边长"),
@@ -430,7 +677,116 @@ localOptions = {
         "isInt": True,
         "toolTip": tr("超过该边长将缩放图片以适配模型输入。"),
     },
+    "auto_trim": {
+        "title": tr("裁掉空白边缘"),
+        "default": "off",
+        "optionsList": [
+            ["off", tr("关闭")],
+            ["on", tr("开启")],
+        ],
+        "toolTip": tr("上传前裁掉与背景色一致的大块空白边缘，减少图像token与上传字节；坐标会自动映射回原图。"),
+    },
+    "image_token_budget": {
+        "title": tr("按计费方式缩放"),
+        "default": "auto",
+        "optionsList": [
+            ["auto", tr("启用")],
+            ["off", tr("关闭")],
+        ],
+        "toolTip": tr("按服务商的图像计费方式（OpenAI 512px瓦片、Gemini 768px瓦片、Qwen-VL 28px块）选择缩放尺寸，在文字可读的前提下减少图像token。"),
+    },
+    "min_text_height": {
+        "title": tr("最小文字行高"),
+        "default": 16,
+        "min": 6,
+        "max": 64,
+        "unit": "px",
+        "isInt": True,
+        "toolTip": tr("按计费方式缩放时，缩放后文字行高不低于该值。双通道模式下行高取自Paddle检测框。"),
+    },
+    "multi_page": {
+        "title": tr("多页图像"),
+        "default": "tiff",
+        "optionsList": [
+            ["tiff", tr("TIFF识别全部页，GIF只识别首帧")],
+            ["all", tr("TIFF与GIF都识别全部页")],
+            ["first", tr("只识别第一页")],
+        ],
+        "toolTip": tr("多页图像逐页并发识别，每页单独请求一次。各页按顺序纵向拼接，坐标为拼接后的位置，每个文本块另带 page 页码。动图 GIF 每帧都会计费，默认只识别首帧。"),
+    },
+    "tile_mode": {
+        "title": tr("超大图像分块识别"),
+        "default": "off",
+        "optionsList": [
+            ["off", tr("关闭")],
+            ["auto", tr("自动")],
+        ],
+        "toolTip": tr("纯文本策略下，长截图、A3扫描件等整图缩放后文字过小时，按可读分辨率切成带重叠的分块并发识别，再拼接结果并去除重叠区的重复文本。"),
+    },
+    "tile_max_count": {
+        "title": tr("最大分块数"),
+        "default": 12,
+        "min": 2,
+        "max": 48,
+        "unit": tr("个"),
+        "isInt": True,
+        "toolTip": tr("分块数超过该值时适当降低分块分辨率，限制单张图像的请求数。"),
+    },
     # 新增：双通道性能优化选项
+    "dual_detector": {
+        "title": tr("本地检测方式"),
+        "default": "paddle",
+        "optionsList": [
+            ["paddle", tr("PaddleOCR 检测+识别")],
+            ["lite", tr("仅检测（内置轻量行检测）")],
+        ],
+        "toolTip": tr("仅检测：不启动 PaddleOCR，用内置的投影法切出文本行框，文字全部由AI按框转写，显著降低本地CPU耗时。适合横排文档与截图，复杂版面建议使用 PaddleOCR。"),
+    },
+    "paddle_instances": {
+        "title": tr("Paddle检测实例数"),
+        "default": 1,
+        "min": 1,
+        "max": 8,
+        "unit": tr("个"),
+        "isInt": True,
+        "toolTip": tr("同时运行的 PaddleOCR-json 检测进程数，CPU线程在实例间平均分配；请求交给最空闲的实例，并发处理多张图像时提高本地检测吞吐。修改后需重启插件。"),
+    },
+    "paddle_cpu_threads": {
+        "title": tr("Paddle线程数"),
+        "default": 0,
+        "min": 0,
+        "max": 64,
+        "unit": tr("个"),
+        "isInt": True,
+        "toolTip": tr("每个检测实例使用的CPU线程数。0为自动：为并发的AI请求预留核心后，启动时用微基准选择检测最快的线程数。"),
+    },
+    "paddle_mkldnn": {
+        "title": tr("Paddle MKL-DNN加速"),
+        "default": "on",
+        "optionsList": [
+            ["on", tr("开启")],
+            ["off", tr("关闭")],
+        ],
+        "toolTip": tr("启用 MKL-DNN 加速本地检测。少数CPU上开启后反而变慢或报错，可关闭。"),
+    },
+    "paddle_ram_max": {
+        "title": tr("Paddle内存上限"),
+        "default": 1024,
+        "min": -1,
+        "max": 16384,
+        "unit": "MB",
+        "isInt": True,
+        "toolTip": tr("检测器内存占用超过该值时自动重启以回收内存，避免长时间批量任务中内存缓慢增长。-1为不限制。"),
+    },
+    "paddle_ram_time": {
+        "title": tr("Paddle内存检查间隔"),
+        "default": 60,
+        "min": 5,
+        "max": 3600,
+        "unit": "s",
+        "isInt": True,
+        "toolTip": tr("检测器空闲超过该时间后检查内存占用并按上限回收。"),
+    },
     "dual_max_boxes": {
         "title": tr("最大识别框数"),
         "default": 30,
@@ -467,4 +823,43 @@ localOptions = {
         "isInt": True,
         "toolTip": tr("对检测框四周增加少量像素，避免裁剪过紧影响识别。"),
     },
+    "dual_correction_mode": {
+        "title": tr("纠错输出方式"),
+        "default": "full",
+        "optionsList": [
+            ["full", tr("整行输出")],
+            ["diff", tr("仅输出改动行")],
+        ],
+        "toolTip": tr("仅输出改动行时，AI只返回需要修正的行（序号+文本），可大幅减少输出量、加快速度；解析失败时自动回退到整行输出。"),
+    },
+    "dual_context_format": {
+        "title": tr("纠错上下文格式"),
+        "default": "lines",
+        "optionsList": [
+            ["lines", tr("编号文本行（精简）")],
+            ["lines_pos", tr("编号文本行+行列提示")],
+            ["json", tr("JSON含坐标（旧版）")],
+        ],
+        "toolTip": tr("发送给AI的Paddle识别上下文格式。去掉坐标可显著减少输入token、降低延迟。可在全局设置中为单个服务商另行指定。"),
+    },
+    "blank_check": {
+        "title": tr("跳过空白图像"),
+        "default": "off",
+        "optionsList": [
+            ["off", tr("关闭")],
+            ["low", tr("保守（仅跳过纯空白）")],
+            ["medium", tr("标准")],
+            ["high", tr("积极")],
+        ],
+        "toolTip": tr("发送前在本地检查灰度方差与边缘密度，判定为无文字的空白页、分隔页直接返回空结果，不请求AI。灵敏度越高越容易判为空白。"),
+    },
+    "blank_check_paddle": {
+        "title": tr("空白检查参考Paddle"),
+        "default": "off",
+        "optionsList": [
+            ["off", tr("关闭")],
+            ["on", tr("开启")],
+        ],
+        "toolTip": tr("开启“跳过空白图像”时，Paddle未检测到任何文字框也视为空白。纯文本策略下会额外运行一次本地检测。"),
+    },
 }